@@ -0,0 +1,203 @@
+# This script compares the context creation times of two SBML4j servers on the same workload
+# Endpoint A is [server] host:port and endpoint B is [server] ahost:bport, unless [compare] names others.
+# Both endpoints get the contexts of the same workload plan (see workload_plan.py), one pair at a time:
+#   interleaved - A and B one after the other, in a random order per context (from the seed of the item)
+#   concurrent - A and B at the same time
+# so that both see the same load on the machine and the network, instead of two runs at different times.
+# Every context is recorded in the results store with its endpoint.
+# For every minSize/maxSize combination the paired differences B - A of the createContext times are
+# reported with a bootstrap confidence interval of their mean; pairs where a context failed or
+# a call had to be retried are left out. The report is logged and written to
+# ab_compare_<run_id>.json in the output_dir
+
+import os
+import sys
+import time
+import json
+
+from client_pool import get_client_pool
+
+import logging
+
+from settings import get_config
+from settings import init_logging
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from context_load import ContextResult
+from network_session import get_network_session
+from results_store import get_results_store
+from results_store import phase_timer
+from resilience import get_resilience
+from workload_plan import get_workload_plan
+from workload_plan import get_context_tasks
+from workload_plan import get_item_seeds
+from workload_plan import get_root_seed
+
+logger = logging.getLogger()
+
+# global definition for the sbml4j-config, read on first use
+config = get_config()
+
+Endpoint = namedtuple('Endpoint', ['label', 'host', 'port'])
+
+def get_endpoints():
+    server_conf = config['server']
+    get_option = lambda option, fallback: config.get('compare', option, fallback='').strip() or fallback
+    endpoint_a = Endpoint('A', get_option('a_host', server_conf.get('host')), get_option('a_port', server_conf.get('port')))
+    endpoint_b = Endpoint('B', get_option('b_host', server_conf.get('ahost')), get_option('b_port', server_conf.get('bport')))
+    return endpoint_a, endpoint_b
+
+class EndpointRunner(object):
+    # creates contexts on one endpoint, with its own connections, session and circuit breaker
+
+    def __init__(self, endpoint, store, base_name, user):
+        self.endpoint = endpoint
+        self.store = store
+        self.base_name = base_name
+        self.user = user
+        self.pool = get_client_pool(config, endpoint.host, endpoint.port)
+        self.session = get_network_session(config)
+        self.resilience = get_resilience(config)
+
+    def get_client(self):
+        return self.resilience.call(self.pool.get_client, self.user)
+
+    def run_context_task(self, task):
+        timings = {}
+        row = {'iteration': task.iteration, 'context_size': task.context_size, 'min_size': task.min_size, 'max_size': task.max_size,
+               'symbol_count': len(task.symbols), 'symbols': task.symbols, 'started_at': time.time(), 'timings': timings,
+               'endpoint': "{}:{}".format(self.endpoint.host, self.endpoint.port)}
+        name_of_network = "ab-{}-number-{}-size-{}-minS-{}-maxS-{}".format(self.endpoint.label, task.iteration, task.context_size, task.min_size, task.max_size)
+        try:
+            client = self.get_client()
+            with phase_timer(timings, 'get_network'):
+                net = self.resilience.call(self.session.get_network, client, self.base_name, stats=row)
+            with phase_timer(timings, 'create_context'):
+                self.resilience.call(net.createContext, task.symbols, networkname=name_of_network, minSize=task.min_size, maxSize=task.max_size, stats=row)
+            row.update({'network_name': net.name, 'node_count': net.numberOfNodes, 'edge_count': net.numberOfRelations})
+            row['success'] = True
+        except Exception as e:
+            logger.info("Context {} failed on endpoint {}: {}".format(name_of_network, self.endpoint.label, e))
+            row['success'] = False
+            row['error'] = str(e)
+        self.store.add(row)
+        # a retried context includes the backoff, it is not a clean measurement
+        clean = row['success'] and not row.get('retries')
+        return ContextResult(task, clean, timings.get('create_context', 0.0))
+
+def run_pair(runner_a, runner_b, task, item_seed, mode, executor):
+    # returns the results of A and B for the task
+    if mode == 'concurrent':
+        future_a = executor.submit(runner_a.run_context_task, task)
+        future_b = executor.submit(runner_b.run_context_task, task)
+        return future_a.result(), future_b.result()
+    if item_seed % 2 == 0:
+        result_a = runner_a.run_context_task(task)
+        result_b = runner_b.run_context_task(task)
+    else:
+        result_b = runner_b.run_context_task(task)
+        result_a = runner_a.run_context_task(task)
+    return result_a, result_b
+
+def bootstrap_mean_interval(values, rng, resamples=2000, confidence=0.95, chunk_size=100):
+    # percentile bootstrap interval of the mean of values
+    means = []
+    for start in range(0, resamples, chunk_size):
+        samples = rng.integers(0, values.size, size=(min(chunk_size, resamples - start), values.size))
+        means.append(values[samples].mean(axis=1))
+    means = np.concatenate(means)
+    alpha = (1.0 - confidence) / 2.0
+    return float(np.quantile(means, alpha)), float(np.quantile(means, 1.0 - alpha))
+
+def compare_latencies(results_a, results_b, rng, resamples=2000, confidence=0.95):
+    # the summary of the paired differences B - A of the clean pairs
+    pairs = [(result_a.elapsed, result_b.elapsed) for result_a, result_b in zip(results_a, results_b) if result_a.success and result_b.success]
+    comparison = {'pairs': len(pairs), 'excluded': len(results_a) - len(pairs)}
+    if not pairs:
+        return comparison
+    latencies = np.array(pairs)
+    deltas = latencies[:, 1] - latencies[:, 0]
+    mean_a = float(latencies[:, 0].mean())
+    low, high = bootstrap_mean_interval(deltas, rng, resamples, confidence)
+    comparison.update({
+        'mean_a': mean_a,
+        'mean_b': float(latencies[:, 1].mean()),
+        'median_a': float(np.median(latencies[:, 0])),
+        'median_b': float(np.median(latencies[:, 1])),
+        'mean_delta': float(deltas.mean()),
+        'median_delta': float(np.median(deltas)),
+        'ci_low': low,
+        'ci_high': high,
+        'confidence': confidence,
+        'relative_delta': float(deltas.mean()) / mean_a if mean_a > 0 else float('nan'),
+    })
+    if high < 0:
+        comparison['verdict'] = 'B faster'
+    elif low > 0:
+        comparison['verdict'] = 'B slower'
+    else:
+        comparison['verdict'] = 'no significant difference'
+    return comparison
+
+def format_comparison(comparison):
+    if comparison['pairs'] == 0:
+        return "no clean pairs ({} excluded)".format(comparison['excluded'])
+    return "{} pairs ({} excluded): A mean {:0.4f} s, B mean {:0.4f} s, B - A {:+0.4f} s ({:+0.1%}), {:0.0%} CI [{:+0.4f}, {:+0.4f}] s: {}".format(
+        comparison['pairs'], comparison['excluded'], comparison['mean_a'], comparison['mean_b'], comparison['mean_delta'],
+        comparison['relative_delta'], comparison['confidence'], comparison['ci_low'], comparison['ci_high'], comparison['verdict'])
+
+def main(sysArgs):
+    init_logging()
+    logger.debug("This script creates the contexts of the workload plan on two SBML4j servers and compares their times")
+    endpoint_a, endpoint_b = get_endpoints()
+    mode = config.get('compare', 'mode', fallback='interleaved')
+    if mode not in ('interleaved', 'concurrent'):
+        raise Exception("Unknown compare mode {}, use interleaved or concurrent".format(mode))
+    resamples = config.getint('compare', 'resamples', fallback=2000)
+    confidence = config.getfloat('compare', 'confidence', fallback=0.95)
+    # get the output_dir
+    output_dir = config['data'].get('output_dir')
+    # get the base network name from config
+    base_name = config['network'].get('base_name')
+    # one row per context and endpoint
+    store = get_results_store(config, "ab_compare")
+    runner_a = EndpointRunner(endpoint_a, store, base_name, "contextcreationtimer")
+    runner_b = EndpointRunner(endpoint_b, store, base_name, "contextcreationtimer")
+    logger.info("Comparing A {}:{} and B {}:{} ({})".format(endpoint_a.host, endpoint_a.port, endpoint_b.host, endpoint_b.port, mode))
+    # the same plan for both, the symbols are those of the base network on A
+    plan = get_workload_plan(config, lambda: runner_a.resilience.call(runner_a.session.get_node_symbols, runner_a.get_client(), base_name))
+    rng = np.random.default_rng(get_root_seed(config))
+
+    report = {'run_id': store.run_id, 'mode': mode,
+              'a': "{}:{}".format(endpoint_a.host, endpoint_a.port), 'b': "{}:{}".format(endpoint_b.host, endpoint_b.port),
+              'combinations': []}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for combination_index in range(len(plan.combinations)):
+            contextMinSize, contextMaxSize = (int(size) for size in plan.combinations[combination_index])
+            tasks = get_context_tasks(plan, combination_index)
+            item_seeds = get_item_seeds(plan, combination_index)
+            results_a = []
+            results_b = []
+            for task, item_seed in zip(tasks, item_seeds):
+                result_a, result_b = run_pair(runner_a, runner_b, task, int(item_seed), mode, executor)
+                results_a.append(result_a)
+                results_b.append(result_b)
+            comparison = compare_latencies(results_a, results_b, rng, resamples, confidence)
+            logger.info("minSize/maxSize {}/{}: {}".format(contextMinSize, contextMaxSize, format_comparison(comparison)))
+            comparison['min_size'] = contextMinSize
+            comparison['max_size'] = contextMaxSize
+            report['combinations'].append(comparison)
+    store.close()
+
+    report_file = os.path.join(output_dir, "ab_compare_{}.json".format(store.run_id))
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info("Wrote comparison report {}".format(report_file))
+
+if __name__ == "__main__":
+
+    main(sys.argv)
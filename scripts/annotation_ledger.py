@@ -0,0 +1,139 @@
+# This module remembers the node annotations uploaded for a network, so that a repeated batch only sends what has changed
+# A batch of annotations is applied to a source network (e.g. a context network reused from the
+# context memo) and every request creates a derived network. The ledger keeps, per source network uuid
+# and annotation name, the values last uploaded, and per source network the network the last batch ended with.
+# When the same annotations are applied to the same source network again, the batch continues from that
+# network, which carries the old values, and sends only the symbols with a new or changed value;
+# annotations without changes are not sent at all, and a batch without changes sends no request.
+# A full upload from the source network is done instead if
+#   - there is no earlier batch with the same annotation names for the source network
+#   - a symbol of the last upload is missing now, a derived network cannot drop a value
+#   - the network of the last batch is gone from the server (checked against the network list with verify)
+# The ledger is kept in annotation_ledger.sqlite in the output_dir.
+# Only a reused context network (see context_memo.py) is annotated again, so the ledger is meant to be
+# enabled together with the [memo] section; without it every batch is a full upload.
+# Configured in the [annotation] section:
+#   delta - send only the changed values
+#   delta_verify - check the network list of the server before continuing from the last network, the list is
+#                  downloaded once per pass (see start_pass)
+
+import os
+import json
+import sqlite3
+import threading
+import time
+
+import logging
+
+from annotations import send_annotations
+from network_session import NetworkListCache
+
+logger = logging.getLogger(__name__)
+
+def get_annotation_ledger(config):
+    # returns the configured ledger, or None if delta uploads are disabled
+    if not config.getboolean('annotation', 'delta', fallback=False):
+        return None
+    ledger_file = os.path.join(config['data'].get('output_dir'), 'annotation_ledger.sqlite')
+    return AnnotationLedger(ledger_file, verify=config.getboolean('annotation', 'delta_verify', fallback=True))
+
+def get_changed_values(previous_values, values):
+    # the values that are new or differ from the previous ones, None if a previous symbol is missing
+    if not previous_values.keys() <= values.keys():
+        return None
+    return {symbol: value for symbol, value in values.items() if symbol not in previous_values or previous_values[symbol] != value}
+
+class AnnotationLedger(object):
+
+    def __init__(self, ledger_file, verify=True):
+        self.verify = verify
+        self._networks = NetworkListCache()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(ledger_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS annotations (source_uuid TEXT, annotation_name TEXT, node_annotation TEXT, "
+                         "uploaded_at REAL, PRIMARY KEY (source_uuid, annotation_name))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS batches (source_uuid TEXT PRIMARY KEY, annotation_names TEXT, network_info TEXT, uploaded_at REAL)")
+        self._db.commit()
+
+    def start_pass(self):
+        # networks may have been removed from the server since the last pass
+        self._networks.clear()
+
+    def _get_last_network(self, source_uuid, annotation_names):
+        with self._lock:
+            row = self._db.execute("SELECT annotation_names, network_info FROM batches WHERE source_uuid = ?", (source_uuid,)).fetchone()
+        if row is None or json.loads(row[0]) != annotation_names:
+            return None
+        return json.loads(row[1])
+
+    def _get_values(self, source_uuid, annotation_name):
+        with self._lock:
+            row = self._db.execute("SELECT node_annotation FROM annotations WHERE source_uuid = ? AND annotation_name = ?",
+                                   (source_uuid, annotation_name)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_delta_requests(self, net, annotation_requests):
+        # the requests with the changed values and the network to apply them to, None if a full upload is needed
+        annotation_names = [annotation_request.annotation_object['nodeAnnotationName'] for annotation_request in annotation_requests]
+        network_info = self._get_last_network(net.uuid, annotation_names)
+        if network_info is None:
+            return None
+        delta_requests = []
+        for annotation_request in annotation_requests:
+            annotation_object = annotation_request.annotation_object
+            previous_values = self._get_values(net.uuid, annotation_object['nodeAnnotationName'])
+            if previous_values is None:
+                return None
+            changed_values = get_changed_values(previous_values, annotation_object['nodeAnnotation'])
+            if changed_values is None:
+                logger.info("Symbols of annotation {} have been removed, uploading it in full".format(annotation_object['nodeAnnotationName']))
+                return None
+            if not changed_values:
+                continue
+            # the network keeps the name of the last batch
+            delta_requests.append(annotation_request._replace(
+                annotation_object={'nodeAnnotationName': annotation_object['nodeAnnotationName'], 'nodeAnnotation': changed_values},
+                networkname=network_info['name'], doPrefixName=False))
+        if self.verify and not self._networks.exists(net.sbml4jApi, network_info['uuid']):
+            logger.info("Annotated network {} is gone from the server, uploading the annotations in full".format(network_info['uuid']))
+            return None
+        return network_info, delta_requests
+
+    def annotate_batch(self, net, annotation_requests, resilience=None, stats=None):
+        # like annotations.annotate_batch, net ends up as the network carrying all annotations
+        annotation_requests = [annotation_request for annotation_request in annotation_requests
+                               if annotation_request.annotation_object.get('nodeAnnotation')]
+        source_uuid = net.uuid
+        delta = self.get_delta_requests(net, annotation_requests)
+        total_values = sum(len(annotation_request.annotation_object['nodeAnnotation']) for annotation_request in annotation_requests)
+        if delta is None:
+            requests_sent = send_annotations(net, annotation_requests, resilience=resilience, stats=stats)
+            values_sent = total_values
+        else:
+            network_info, delta_requests = delta
+            net.updateInfo(network_info)
+            requests_sent = send_annotations(net, delta_requests, resilience=resilience, stats=stats)
+            values_sent = sum(len(delta_request.annotation_object['nodeAnnotation']) for delta_request in delta_requests)
+        logger.info("Sent %d of %d annotation values in %d requests for network %s", values_sent, total_values, requests_sent, source_uuid)
+        if stats is not None:
+            stats['annotation_values'] = stats.get('annotation_values', 0) + values_sent
+        self._remember(source_uuid, annotation_requests, net.getInfoDict())
+        self._networks.add(net.sbml4jApi, net.uuid)
+        return requests_sent
+
+    def _remember(self, source_uuid, annotation_requests, network_info):
+        uploaded_at = time.time()
+        with self._lock:
+            for annotation_request in annotation_requests:
+                annotation_object = annotation_request.annotation_object
+                self._db.execute("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)",
+                                 (source_uuid, annotation_object['nodeAnnotationName'], json.dumps(annotation_object['nodeAnnotation']), uploaded_at))
+            annotation_names = [annotation_request.annotation_object['nodeAnnotationName'] for annotation_request in annotation_requests]
+            self._db.execute("INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?)",
+                             (source_uuid, json.dumps(annotation_names), json.dumps(network_info), uploaded_at))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,83 @@
+# This module builds the node annotations for the SBML4j networks and uploads them as one batch
+# All configured annotations are built in a single pass over the parsed node attributes,
+# instead of one pass over all nodes per property.
+# The annotation endpoint of SBML4j takes one node annotation (name and values) per request and
+# every request creates the derived network the next one has to build upon, so the batch is
+# sent as one request per non-empty annotation, back to back, without any work in between.
+# With a Resilience every request is retried on its own, so a retry never repeats an annotation
+# that has already been applied. With an AnnotationLedger only the changed values are sent
+
+import logging
+
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# annotation_object - the dictionary with nodeAnnotationName and nodeAnnotation
+# networkname, doPrefixName - naming of the derived network, as for Network.annotate
+# begin_message, end_message - optional log lines (the MARKER lines of the scripts) around the request
+AnnotationRequest = namedtuple('AnnotationRequest', ['annotation_object', 'networkname', 'doPrefixName', 'begin_message', 'end_message'],
+                               defaults=(None, None))
+
+def get_boolean_true_annotation_object(name, node_symbols):
+    annotation_object = {}
+    annotation_object['nodeAnnotationName'] = name
+    annotation_object['nodeAnnotation'] = dict.fromkeys(node_symbols, True)
+
+    return annotation_object
+
+def get_annotation_object(name, node_symbols, annotation_map):
+    annotation_object = {}
+    annotation_object['nodeAnnotationName'] = name
+    annotation_object['nodeAnnotation'] = {node_symbol: annotation_map[node_symbol] for node_symbol in node_symbols}
+
+    return annotation_object
+
+def get_symbol_annotation_maps(node_attributes, node_properties):
+    # one pass over the nodes: for every property, a map of node symbol to the property value
+    # if several nodes share a symbol, the value of the last of them is used
+    symbol_annotation_maps = {}
+    for node_property in node_properties:
+        symbol_annotation_maps[node_property] = {}
+    for node_attribute_map in node_attributes.values():
+        symbol = node_attribute_map.get('symbol')
+        if symbol is None:
+            continue
+        for node_property in node_properties:
+            symbol_annotation_maps[node_property][symbol] = node_attribute_map[node_property]
+    return symbol_annotation_maps
+
+def get_property_annotation_objects(name_prefix, node_symbols, symbol_annotation_maps):
+    # the annotation objects of all properties, named <name_prefix>_<property>
+    annotation_objects = {}
+    for node_property, symbol_annotation_map in symbol_annotation_maps.items():
+        annotation_objects[node_property] = get_annotation_object("{}_{}".format(name_prefix, node_property), node_symbols, symbol_annotation_map)
+    return annotation_objects
+
+def annotate_batch(net, annotation_requests, resilience=None, stats=None, ledger=None):
+    # applies all annotation requests to net in order, net ends up as the network carrying all of them
+    # with a ledger, only the values changed since the last batch for net are sent, see annotation_ledger.py
+    # returns the number of requests sent to the server
+    if ledger is not None:
+        return ledger.annotate_batch(net, annotation_requests, resilience=resilience, stats=stats)
+    return send_annotations(net, annotation_requests, resilience=resilience, stats=stats)
+
+def send_annotations(net, annotation_requests, resilience=None, stats=None):
+    # sends every non-empty annotation request in full
+    requests_sent = 0
+    for annotation_request in annotation_requests:
+        annotation_object = annotation_request.annotation_object
+        if not annotation_object.get('nodeAnnotation'):
+            logger.info("Skipping empty annotation {}".format(annotation_object.get('nodeAnnotationName')))
+            continue
+        if annotation_request.begin_message is not None:
+            logger.info(annotation_request.begin_message)
+        if resilience is not None:
+            resilience.call(net.annotate, annotationDict=annotation_object, networkname=annotation_request.networkname,
+                            doPrefixName=annotation_request.doPrefixName, stats=stats)
+        else:
+            net.annotate(annotationDict=annotation_object, networkname=annotation_request.networkname, doPrefixName=annotation_request.doPrefixName)
+        if annotation_request.end_message is not None:
+            logger.info(annotation_request.end_message)
+        requests_sent += 1
+    return requests_sent
@@ -1,51 +1,55 @@
 # This is the benchmarking script that generates context networks with random genes
 # This version iterates 'iter' times and creates contexts for 1, 2, 3, ..., size number of randomly drawn symbols
 # The size value is randomly applied, so for each iteration, the order of the sizes differs
+# All sizes and symbols are drawn up front into the workload plan (see workload_plan.py), a failed
+# context does not change the contexts that follow it
 # It might be necessary to also evaluate the database query times, and in general times on the server side, not only client
 # The timing data is put in the graphml files that are generated
+# and, for every phase of creating a context, in the results store (benchmark_results.jsonl/.sqlite in the output_dir)
 
 import os
 import sys
 import time
 
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+from client_pool import get_client_pool
 
 import logging
-from logging.config import fileConfig
-import configparser
 
-import xml.etree.ElementTree as ET
+from settings import get_config
+from settings import init_logging
+from settings import abbreviate
 
-from codetiming import Timer
+from context_load import ContextResult
+from context_load import run_concurrent
+from context_load import summarize_latencies
+from context_load import format_summary
 
-from random import seed
-from random import randint
-from random import choices
+from network_session import get_network_session
+
+from results_store import get_results_store
+from results_store import phase_timer
+
+from run_journal import get_run_journal
+
+from resilience import get_resilience
+
+from workload_plan import get_workload_plan
+from workload_plan import get_context_tasks
+
+from context_memo import get_context_memo
+
+from graphml_export import download_graphml
+from graphml_codec import get_output_codec
 
 
-# global definitions for the log-config
-configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
 
-# global definition for the sbml4j-config
-config = configparser.ConfigParser()
-config.read('{}/config.ini'.format(configFolder))
+# global definition for the sbml4j-config, read on first use
+config = get_config()
 
 def init_sbml4j(user=None):
-
-    server_conf = config['server']
-    host = server_conf.get('host')
-    if not host.startswith('http'):
-        host = "{}{}".format("http://", host)
-    if user != None:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context'), user=user))
-        return client
-    else:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context')))
-        return client
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
 
 def get_key_mapping(root):
     key_mapping = {}
@@ -101,84 +105,130 @@ def get_annotation_object(name, node_symbols, annotation_map):
 
     return annotation_object
 
-def draw_elements(all_elements, number_to_draw):
-    returnList = []
-    for i in range(number_to_draw):
-        list_index = randint(0, len(all_elements)-1) 
-        returnList.append(all_elements[list_index])
-    return returnList
-
-def adapt_weight(weight, index, total):
-    weight = [w + 1/(total*(len(weight))) for w in weight]
-    weight[index-1] = weight[index-1]-1/(total*(len(weight)))-1/total
-    return weight
+def write_context_graphml(net, output_dir, elapsed_time, timings):
+    cte = time.asctime(time.localtime()).split(" ")
+    current_time="-".join([str(time.time()), cte[4], cte[1], cte[2], cte[3].replace(':','-')])
+    netname = (net.name).translate({ord(i): None for i in "[]',"}).replace(' ', '-')
+    filename="{}-elapsed-{:0.4f}-{}.graphml".format(current_time, elapsed_time, netname)
+    output_file=os.path.join(output_dir, filename)
+    # stream the graphml to the file, download and write times are recorded separately
+    return download_graphml(net, output_file, timings=timings, codec=get_output_codec(config))
+
+def get_unit(task):
+    # the unit of work in the run journal, the item seed tells the contexts of different plans apart
+    return {'min_size': int(task.min_size), 'max_size': int(task.max_size), 'iteration': task.iteration, 'seed': task.seed}
+
+def run_context_task(client, session, store, journal, resilience, memo, base_name, output_dir, task, timings=None):
+    # creates the context of one planned task and records it in the results store and the run journal
+    # the server calls are retried by resilience, the retries end up in the row of the context
+    if timings is None:
+        timings = {}
+    row = {'iteration': task.iteration, 'context_size': task.context_size, 'min_size': int(task.min_size), 'max_size': int(task.max_size),
+           'symbol_count': len(task.symbols), 'symbols': task.symbols, 'started_at': time.time(), 'timings': timings}
+    name_of_network = "number-{}-size-{}-minS-{}-maxS-{}-symbols-{}".format(task.iteration, task.context_size, task.min_size, task.max_size, task.symbols)
+    # imported here, codetiming is only needed once a context is created
+    from codetiming import Timer
+    # the time is logged with the context below, not printed by the timer
+    t = Timer("context_timer_{}_{}_{}/{}".format(task.iteration, task.context_size, task.min_size, task.max_size), logger=None)
+    try:
+        with phase_timer(timings, 'get_network'):
+            net = resilience.call(session.get_network, client, base_name, stats=row)
+        t.start()
+        memo_entry = None
+        with phase_timer(timings, 'create_context'):
+            if memo is not None:
+                memo_entry = memo.create_context(net, task.symbols, task.min_size, task.max_size, networkname=name_of_network, resilience=resilience, stats=row)
+                row['memo_hit'] = memo_entry.reused
+            else:
+                resilience.call(net.createContext, task.symbols, networkname=name_of_network, minSize=task.min_size, maxSize=task.max_size, stats=row)
+        elapsed_time = t.stop()
+        logger.info("Created network context for %s with timer %s which took %s seconds", abbreviate(task.symbols), t, elapsed_time)
+        row.update({'network_name': net.name, 'node_count': net.numberOfNodes, 'edge_count': net.numberOfRelations})
+        if memo_entry is not None and memo_entry.output_file is not None:
+            row['output_file'] = memo_entry.output_file
+        else:
+            row['output_file'] = resilience.call(write_context_graphml, net, output_dir, elapsed_time, timings, stats=row)
+            if memo_entry is not None:
+                memo.remember_output(memo_entry.key, row['output_file'])
+        row['success'] = True
+        result = ContextResult(task, True, elapsed_time)
+    except Exception as e:
+        logger.info("Skipping context for %s, as it could not be generated: %s", name_of_network, e)
+        row['success'] = False
+        row['error'] = str(e)
+        result = ContextResult(task, False, 0.0)
+    store.add(row)
+    if result.success and journal is not None:
+        journal.record(output_file=row['output_file'], **get_unit(task))
+    return result
+
+def run_concurrent_combination(client, session, store, journal, resilience, memo, base_name, output_dir, workers, tasks, max_failures=None):
+    # every worker thread gets its own client from the pool
+    run_task = lambda task: run_context_task(resilience.call(init_sbml4j, user = client.user), session, store, journal, resilience, memo, base_name, output_dir, task)
+    results, wall_time = run_concurrent(tasks, run_task, workers, max_failures)
+    return results, wall_time
 
 def main(sysArgs):
+    init_logging()
     logger.debug("This script generates contexts for random sets of gene-symbols of the base network provided in the config file")
-    client = init_sbml4j(user = "contextcreationtimer")
+    # transient server errors are retried, a failing server pauses the run
+    resilience = get_resilience(config)
+    client = resilience.call(init_sbml4j, user = "contextcreationtimer")
+    # repeated requests reuse their context network, only if [memo] benchmarks is set
+    memo = get_context_memo(config, benchmark=True)
+    # the base network and its symbols are only fetched once per session
+    session = get_network_session(config)
+    # one row with the timings of all phases per context
+    store = get_results_store(config, "benchmark_main")
+    # finished iterations of an interrupted run are skipped
+    journal = get_run_journal(config, "benchmark_main")
     # get the output_dir
     output_dir = config['data'].get('output_dir')
-    # intialize the random number generator
-    seed(config['random'].get('seed'))
     # get the base network name from config
     base_name = config['network'].get('base_name')
-    
-    # get the number of iterations
-    total_iterations = config.getint('loop', 'iter')
-    # get the max number of symbols
-    max_symbol_count = config.getint('loop', 'size')
+    # all contexts to create, generated from the [random] seed or loaded from the [plan] file
+    plan = get_workload_plan(config, lambda: resilience.call(session.get_node_symbols, client, base_name))
+    # get the number of concurrent clients, 1 creates the contexts one at a time
+    workers = config['loop'].getint('workers', fallback=1)
+    # a combination is given up after this many failed contexts
+    max_failures = config.getint('resilience', 'max_failures', fallback=10)
 
     # iterate through different combinations of minSize/maxSize
-    context_sizes = config['loop'].get('combinations').split(',')
-    for context_combination in context_sizes:
-        sizes = context_combination.split('-')
-        contextMinSize=sizes[0]
-        contextMaxSize=sizes[1]
-        logger.info("Creating {} network contexts for minSize/maxSize: {}/{}".format(total_iterations, contextMinSize, contextMaxSize))
-        # we want to rougly equally distribute the sizes of the gene-lists over all iterations
-        # The Idea:
-        # We create population and weights lists to use with random.choices
-        # After each iteration we adapt the weights to reflect the sizes used in the last iteration
-        population = [*range(1, max_symbol_count+1, 1)]
-        weight = [1 / max_symbol_count for p in population]
-        logger.debug("Starting weights are: {}".format(weight))
-
-        iteration = 1
-        #for iteration in range(1,total_iterations+1):
-        while iteration < total_iterations+1:    
-            # get the base network
-            net = client.getNetworkByName(base_name)
-            # get all symbols
-            network_nodeSymbols = net.getOptions()['filter']['nodeSymbols']
-            # choose a context size
-            context_size = choices(population, weight)[0]
-            context_symbols = draw_elements(network_nodeSymbols, context_size)
- 
-            # create context
-            # initialize the timer
-            t = Timer("context_timer_{}_{}_{}/{}".format(iteration, context_size, contextMinSize, contextMaxSize))
-            t.start()
-            # calculate the actual context
-            try:
-                name_of_network = "number-{}-size-{}-minS-{}-maxS-{}-symbols-{}".format(iteration, context_size, contextMinSize, contextMaxSize, context_symbols)
-                net.createContext(context_symbols, networkname=name_of_network, minSize=contextMinSize, maxSize=contextMaxSize)
-                elapsed_time = t.stop()
-                logger.info("Created network context for {} with timer {} which took {} seconds".format(context_symbols, t, elapsed_time))
-                cte = time.asctime(time.localtime()).split(" ")
-                current_time="-".join([str(time.time()), cte[4], cte[1], cte[2], cte[3].replace(':','-')])
-                netname = (net.name).translate({ord(i): None for i in "[]',"}).replace(' ', '-')
-                filename="{}-elapsed-{:0.4f}-{}.graphml".format(current_time, elapsed_time, netname)
-                output_file=os.path.join(output_dir, filename)
-                graphML = net.graphML()
-                with open(output_file, 'w') as f:
-                    f.write(net.graphML())
-                # adapt the weights after successfully creating a context
-                weight = adapt_weight(weight, context_size, total_iterations)
-                logger.debug("Current weights after iteration {} are {}".format(iteration, weight))
-                # then increase the iteration variable
-                iteration += 1
-            except:
-                logger.info("Skipping context for {}, as it could not be generated".format(name_of_network))
+    for combination_index in range(len(plan.combinations)):
+        contextMinSize, contextMaxSize = (int(size) for size in plan.combinations[combination_index])
+        tasks = get_context_tasks(plan, combination_index)
+        logger.info("Creating {} network contexts for minSize/maxSize: {}/{}".format(len(tasks), contextMinSize, contextMaxSize))
+        if journal is not None:
+            # the plan is the same as in the interrupted run, only the unfinished contexts are created
+            pending_tasks = [task for task in tasks if not journal.is_done(**get_unit(task))]
+            if len(pending_tasks) < len(tasks):
+                logger.info("Skipping {} contexts for minSize/maxSize {}/{}, they have been finished before".format(len(tasks) - len(pending_tasks), contextMinSize, contextMaxSize))
+            tasks = pending_tasks
+        if workers > 1:
+            results, wall_time = run_concurrent_combination(client, session, store, journal, resilience, memo, base_name, output_dir, workers, tasks, max_failures)
+            logger.info("Concurrent run with {} workers for minSize/maxSize {}/{}: {}".format(workers, contextMinSize, contextMaxSize, format_summary(summarize_latencies(results, wall_time))))
+            continue
+
+        results = []
+        start_time = time.perf_counter()
+        failures = 0
+        for task in tasks:
+            # create context and download it
+            result = run_context_task(client, session, store, journal, resilience, memo, base_name, output_dir, task)
+            results.append(result)
+            if not result.success:
+                failures += 1
+                if failures >= max_failures:
+                    logger.error("Giving up on minSize/maxSize {}/{} after {} failed contexts".format(contextMinSize, contextMaxSize, failures))
+                    break
+        wall_time = time.perf_counter() - start_time
+        logger.info("Sequential run for minSize/maxSize {}/{}: {}".format(contextMinSize, contextMaxSize, format_summary(summarize_latencies(results, wall_time))))
+
+    store.close()
+    if journal is not None:
+        journal.close()
+    if memo is not None:
+        memo.close()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,90 @@
+# This module shares the connections to the SBML4j server between all clients of a run
+# pysbml4j creates a new urllib3 PoolManager for every Sbml4j client, so every user
+# (and every worker thread) opened its own connections.
+# The ClientPool keeps one PoolManager with persistent keep-alive connections to
+# [server] host:port and hands out per-user clients that send their requests over it.
+# A client changes its request headers while sending, so every thread gets its own
+# client for each user; these are cheap views over the shared connections
+# The status of the last response is kept for every thread, see get_last_status
+# urllib3 and pysbml4j are only imported when the first pool is created (see pooled_client.py),
+# so that importing a script, or resilience for get_last_status, stays cheap
+
+import threading
+
+_client_pools = {}
+_client_pools_lock = threading.Lock()
+_last_status = threading.local()
+
+def get_last_status():
+    # the http status of the last response received by this thread, None if there was none since the reset
+    return getattr(_last_status, 'status', None)
+
+def reset_last_status():
+    _last_status.status = None
+
+def set_last_status(status):
+    _last_status.status = status
+
+def get_client_pool(config, host=None, port=None):
+    # returns the pool for the configured server, creating it on first use
+    # host and port select another server than the one of the [server] section
+    server_conf = config['server']
+    if host is None:
+        host = server_conf.get('host')
+    if port is None:
+        port = server_conf.get('port')
+    if not host.startswith('http'):
+        host = "{}{}".format("http://", host)
+    num_pools = server_conf.getint('pool_connections', fallback=4)
+    maxsize = server_conf.getint('pool_maxsize', fallback=10)
+    block = server_conf.getboolean('pool_block', fallback=False)
+    # the pool settings are part of the key, a runner job overriding them gets a pool of its own
+    key = (host, port, server_conf.get('application_context'), num_pools, maxsize, block)
+    with _client_pools_lock:
+        client_pool = _client_pools.get(key)
+        if client_pool is None:
+            client_pool = ClientPool(host, port, server_conf.get('application_context'),
+                                     num_pools=num_pools, maxsize=maxsize, block=block)
+            _client_pools[key] = client_pool
+    return client_pool
+
+def invalidate_network_lists():
+    # the clients of this thread fetch the network list from the server again before they use it
+    with _client_pools_lock:
+        client_pools = list(_client_pools.values())
+    for client_pool in client_pools:
+        for client in getattr(client_pool._local, 'clients', {}).values():
+            client.configuration.isInSync = False
+
+class ClientPool(object):
+
+    def __init__(self, host, port, application_context, num_pools=4, maxsize=10, block=False):
+        # num_pools - number of hosts to keep connections for
+        # maxsize - number of keep-alive connections kept open to the server
+        # block - if True, never open more than maxsize connections and wait for a free one instead
+        self.host = host
+        self.port = port
+        self.application_context = application_context
+        from pooled_client import create_pool_manager
+        self._pm = create_pool_manager(num_pools, maxsize, block)
+        self._local = threading.local()
+
+    @property
+    def pool_manager(self):
+        return self._pm
+
+    def get_client(self, user=None):
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = {}
+            self._local.clients = clients
+        client = clients.get(user)
+        if client is None:
+            from pooled_client import create_client
+            client = create_client(self.host, self.port, self.application_context, user, self._pm)
+            clients[user] = client
+        return client
+
+    def clear(self):
+        # close all connections, the clients of the pool open new ones when they are used again
+        self._pm.clear()
@@ -0,0 +1,73 @@
+# This module runs a planned context creation workload with several concurrent clients
+# The benchmark scripts build the list of contexts to create up front (the workload plan)
+# and either work through it one at a time, or hand it to run_concurrent, which
+# executes it with a pool of worker threads, each one using its own Sbml4j client from the client pool.
+# summarize_latencies reports the throughput and latency percentiles of either mode
+# Like the sequential loops, run_concurrent gives up after max_failures failed tasks, the tasks not
+# started by then are skipped
+
+import math
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# seed - the item seed of the workload plan, None for tasks that do not come from a plan
+ContextTask = namedtuple('ContextTask', ['iteration', 'context_size', 'min_size', 'max_size', 'symbols', 'seed'], defaults=(None,))
+ContextResult = namedtuple('ContextResult', ['task', 'success', 'elapsed'])
+
+def run_concurrent(tasks, run_task, workers, max_failures=None):
+    # run_task is called with each task from one of the worker threads and returns a ContextResult
+    # returns the results of the tasks run, in task order, and the wall time of the whole workload
+    lock = threading.Lock()
+    failures = 0
+
+    def run_counted_task(task):
+        # None for a task skipped after max_failures failed tasks
+        nonlocal failures
+        with lock:
+            if max_failures is not None and failures >= max_failures:
+                return None
+        result = run_task(task)
+        if not result.success:
+            with lock:
+                failures += 1
+        return result
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_counted_task, tasks))
+    wall_time = time.perf_counter() - start_time
+    skipped = results.count(None)
+    if skipped:
+        logger.error("Gave up after {} failed contexts, skipped the remaining {} contexts".format(failures, skipped))
+    return [result for result in results if result is not None], wall_time
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, int(math.ceil(p / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def summarize_latencies(results, wall_time):
+    latencies = sorted(result.elapsed for result in results if result.success)
+    summary = {}
+    summary['contexts'] = len(latencies)
+    summary['failures'] = len(results) - len(latencies)
+    summary['wall_time'] = wall_time
+    summary['throughput'] = len(latencies) / wall_time if wall_time > 0 else float('nan')
+    summary['p50'] = percentile(latencies, 50)
+    summary['p90'] = percentile(latencies, 90)
+    summary['p99'] = percentile(latencies, 99)
+    return summary
+
+def format_summary(summary):
+    return "{} contexts ({} failed) in {:0.4f} s: {:0.4f} contexts/s, p50 {:0.4f} s, p90 {:0.4f} s, p99 {:0.4f} s".format(
+        summary['contexts'], summary['failures'], summary['wall_time'], summary['throughput'],
+        summary['p50'], summary['p90'], summary['p99'])
@@ -0,0 +1,120 @@
+# This module remembers the context networks created on the server, so that the same request is only served once
+# A request is made canonical by removing duplicate symbols and sorting them; together with
+# minSize, maxSize, the base network, the user and the requested network name it forms the key of the memo.
+# The name is part of the key, as it names the outputs: two inputs with the same symbols must not share a network.
+# For every key the memo keeps the info of the created context network and, once it has been
+# downloaded, the local graphml file. A repeated request turns the Network into the known
+# context network without a createContext call, and the download can be skipped if the file is still there.
+# The memo is kept in context_memo.sqlite in the output_dir, so it is shared by all runs.
+# Configured in the [memo] section:
+#   enabled - use the memo at all
+#   benchmarks - also use it in the benchmark scripts, off by default, as they time the server
+#   verify - check the network list of the server before reusing a context network, the list is
+#            downloaded once per pass (see start_pass)
+
+import os
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+from network_session import NetworkListCache
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# key - the key of the canonical request
+# network_info - the info dictionary of the context network
+# output_file - the downloaded graphml of the context network, None if there is none (yet)
+# reused - True if the context network had been created before
+MemoEntry = namedtuple('MemoEntry', ['key', 'network_info', 'output_file', 'reused'])
+
+def get_context_memo(config, benchmark=False):
+    # returns the configured memo, or None if it is disabled (or bypassed for benchmark runs)
+    if not config.getboolean('memo', 'enabled', fallback=False):
+        return None
+    if benchmark and not config.getboolean('memo', 'benchmarks', fallback=False):
+        return None
+    memo_file = os.path.join(config['data'].get('output_dir'), 'context_memo.sqlite')
+    return ContextMemo(memo_file, verify=config.getboolean('memo', 'verify', fallback=True))
+
+def get_canonical_symbols(symbols):
+    return sorted(set(symbols))
+
+def get_memo_key(user, base_uuid, symbols, min_size, max_size, networkname=None):
+    canonical_request = [user, base_uuid, get_canonical_symbols(symbols),
+                         int(min_size) if min_size is not None else None,
+                         int(max_size) if max_size is not None else None, networkname]
+    return hashlib.sha256(json.dumps(canonical_request).encode('utf-8')).hexdigest()
+
+class ContextMemo(object):
+
+    def __init__(self, memo_file, verify=True):
+        self.verify = verify
+        self._networks = NetworkListCache()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(memo_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS contexts (memo_key TEXT PRIMARY KEY, network_info TEXT, output_file TEXT, created_at REAL)")
+        self._db.commit()
+
+    def start_pass(self):
+        # networks may have been removed from the server since the last pass
+        self._networks.clear()
+
+    def lookup(self, net, symbols, min_size, max_size, networkname=None):
+        # the entry of the context for the given base network, None if it has not been created before
+        key = get_memo_key(net.sbml4jApi.user, net.uuid, symbols, min_size, max_size, networkname)
+        with self._lock:
+            row = self._db.execute("SELECT network_info, output_file FROM contexts WHERE memo_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        network_info = json.loads(row[0])
+        output_file = row[1]
+        if self.verify and not self._networks.exists(net.sbml4jApi, network_info['uuid']):
+            logger.info("Context network {} is gone from the server, creating it again".format(network_info['uuid']))
+            self.forget(key)
+            return None
+        if output_file is not None and not os.path.exists(output_file):
+            output_file = None
+        return MemoEntry(key, network_info, output_file, True)
+
+    def create_context(self, net, symbols, min_size, max_size, networkname=None, resilience=None, stats=None):
+        # like net.createContext, but a request that has been served before turns net into the known context network
+        # returns the MemoEntry, its output_file tells whether the graphml is available locally
+        entry = self.lookup(net, symbols, min_size, max_size, networkname)
+        if entry is not None:
+            logger.info("Reusing context network %s for %d symbols", entry.network_info['uuid'], len(symbols))
+            net.updateInfo(entry.network_info)
+            return entry
+        key = get_memo_key(net.sbml4jApi.user, net.uuid, symbols, min_size, max_size, networkname)
+        canonical_symbols = get_canonical_symbols(symbols)
+        if resilience is not None:
+            resilience.call(net.createContext, canonical_symbols, networkname=networkname, minSize=min_size, maxSize=max_size, stats=stats)
+        else:
+            net.createContext(canonical_symbols, networkname=networkname, minSize=min_size, maxSize=max_size)
+        network_info = net.getInfoDict()
+        self._networks.add(net.sbml4jApi, network_info['uuid'])
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO contexts VALUES (?, ?, ?, ?)", (key, json.dumps(network_info), None, time.time()))
+            self._db.commit()
+        return MemoEntry(key, network_info, None, False)
+
+    def remember_output(self, key, output_file):
+        # the graphml of the context network of key has been downloaded to output_file
+        with self._lock:
+            self._db.execute("UPDATE contexts SET output_file = ? WHERE memo_key = ?", (output_file, key))
+            self._db.commit()
+
+    def forget(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM contexts WHERE memo_key = ?", (key,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
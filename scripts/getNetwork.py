@@ -1,37 +1,23 @@
 import os
 import sys
 
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+from client_pool import get_client_pool
+from graphml_export import download_graphml
+from graphml_codec import get_output_codec
 
 import logging
-from logging.config import fileConfig
-import configparser
 
-import xml.etree.ElementTree as ET
+from settings import get_config
+from settings import init_logging
 
-# global definitions for the log-config
-configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
 
-# global definition for the sbml4j-config
-config = configparser.ConfigParser()
-config.read('{}/config.ini'.format(configFolder))
+# global definition for the sbml4j-config, read on first use
+config = get_config()
 
 def init_sbml4j(user=None):
-
-    server_conf = config['server']
-    host = server_conf.get('host')
-    if not host.startswith('http'):
-        host = "{}{}".format("http://", host)
-    if user != None:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context'), user=user))
-        return client
-    else:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context')))
-        return client
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
 
 def get_key_mapping(root):
     key_mapping = {}
@@ -88,6 +74,7 @@ def get_annotation_object(name, node_symbols, annotation_map):
     return annotation_object
 
 def main(sysArgs):
+    init_logging()
     logger.debug("This script retrieves the network provided by the name or uuid of the input")
     uuid = sysArgs[1]
     logger.info("Retrieving network with uuid {}".format(uuid))
@@ -99,9 +86,7 @@ def main(sysArgs):
     net = client.getNetwork(uuid)
     filename="{}.graphml".format(uuid)
     output_file=os.path.join(output_dir, filename)
-    graphML = net.graphML()
-    with open(output_file, 'w') as f:
-        f.write(graphML)
+    download_graphml(net, output_file, codec=get_output_codec(config))
 
 if __name__ == "__main__":
 
@@ -0,0 +1,195 @@
+# This module keeps the results of reading graphml files in a persistent on-disk cache
+# so that repeated runs over the same /graphml inputs do not parse the xml again
+#
+# The cache directory holds two kinds of files:
+#   index/<key>    - key is the hash of the file path, size, mtime and the attribute type map,
+#                    the file contains the sha256 of the graphml content
+#   entries/<sha256 of content>-<hash of type map>.bin
+#                  - the key mapping, node id to symbol map and typed node attributes,
+#                    pickled and zlib compressed
+# A changed path, size or mtime only costs hashing the file content, a changed content
+# costs a full parse. The entries and index files are evicted least recently used first once
+# their total size exceeds the configured maximum, down to 90% of it.
+# The size of the cache is scanned once and then counted up with every file written. A copy of the
+# cache sent to a worker process never evicts, its owner does after the workers are done (see evict).
+# An entry that cannot be read back (truncated, corrupt) counts as a miss and is parsed again
+
+import os
+import hashlib
+import json
+import pickle
+import threading
+import zlib
+
+import logging
+
+from graphml_reader import GraphMLContent
+from graphml_reader import read_graphml
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = b'GMC1'
+
+# the fraction of max_bytes left after an eviction, so that the next files fit without evicting again
+EVICT_TARGET = 0.9
+
+def get_graphml_cache(config):
+    # returns the cache configured in the [cache] section, or None if caching is disabled
+    if not config.has_section('cache') or not config['cache'].getboolean('enabled', fallback=False):
+        return None
+    cache_dir = config['cache'].get('dir')
+    max_bytes = config['cache'].getint('max_size_mb', fallback=1024) * 1024 * 1024
+    return GraphMLCache(cache_dir, max_bytes)
+
+def get_file_digest(path, chunk_size=1024*1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_type_map_digest(name_to_type_map):
+    encoded = json.dumps(sorted((name_to_type_map or {}).items())).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def write_atomic(path, data):
+    # write to a temporary file first, so that concurrent readers never see a partial file
+    # the name is unique per process and thread, threads may store the same content at the same time
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class GraphMLCache(object):
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_dir = os.path.join(cache_dir, 'index')
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(self.entries_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # the bytes in the cache, scanned on the first write
+        self._total_bytes = None
+        self._owner = True
+
+    def __getstate__(self):
+        # the copy for a worker process only reads and writes files, the owner evicts
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_total_bytes'] = None
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def read(self, path, name_to_type_map=None):
+        # returns the GraphMLContent of the file, parsing it only if it is not cached yet
+        type_digest = get_type_map_digest(name_to_type_map)
+        stat = os.stat(path)
+        index_key = "{}\0{}\0{}\0{}".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns, type_digest)
+        index_file = os.path.join(self.index_dir, hashlib.sha256(index_key.encode('utf-8')).hexdigest())
+
+        content_digest = self._read_index(index_file)
+        if content_digest is not None:
+            graphml_content = self._load_entry(content_digest, type_digest)
+            if graphml_content is not None:
+                return graphml_content
+        # the file is new or was touched, check whether the content is already known
+        content_digest = get_file_digest(path)
+        self._write(index_file, content_digest.encode('ascii'))
+        graphml_content = self._load_entry(content_digest, type_digest)
+        if graphml_content is not None:
+            return graphml_content
+        logger.debug("Parse cache miss for {}".format(path))
+        graphml_content = read_graphml(path, name_to_type_map)
+        self._store_entry(content_digest, type_digest, graphml_content)
+        return graphml_content
+
+    def _entry_file(self, content_digest, type_digest):
+        return os.path.join(self.entries_dir, "{}-{}.bin".format(content_digest, type_digest))
+
+    def _read_index(self, index_file):
+        try:
+            with open(index_file, 'rb') as f:
+                return f.read().decode('ascii')
+        except FileNotFoundError:
+            return None
+
+    def _load_entry(self, content_digest, type_digest):
+        entry_file = self._entry_file(content_digest, type_digest)
+        try:
+            with open(entry_file, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(CACHE_FORMAT):
+            return None
+        # mark the entry as recently used for the eviction
+        try:
+            os.utime(entry_file)
+        except FileNotFoundError:
+            pass
+        try:
+            return GraphMLContent(*pickle.loads(zlib.decompress(data[len(CACHE_FORMAT):])))
+        except (zlib.error, pickle.UnpicklingError, EOFError, TypeError, ValueError) as e:
+            logger.debug("Ignoring unreadable parse cache entry {}: {}".format(entry_file, e))
+            return None
+
+    def _store_entry(self, content_digest, type_digest, graphml_content):
+        data = zlib.compress(pickle.dumps(tuple(graphml_content), protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self._write(self._entry_file(content_digest, type_digest), CACHE_FORMAT + data)
+
+    def _write(self, path, data):
+        # writes a cache file and keeps the running total, evicting once it exceeds max_bytes
+        write_atomic(path, data)
+        if not self._owner:
+            return
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total()
+            else:
+                self._total_bytes += len(data)
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _list_files(self):
+        # (mtime, size, path) of all index and entry files
+        files = []
+        for folder in (self.index_dir, self.entries_dir):
+            for entry in os.scandir(folder):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry.path))
+        return files
+
+    def _scan_total(self):
+        return sum(size for mtime, size, path in self._list_files())
+
+    def evict(self):
+        # remove the least recently used files until the cache fits into max_bytes again
+        # also called after the worker processes have written to the cache, the total is scanned again then
+        with self._lock:
+            files = self._list_files()
+            total_bytes = sum(size for mtime, size, path in files)
+            if total_bytes > self.max_bytes:
+                target_bytes = self.max_bytes * EVICT_TARGET
+                files.sort()
+                for mtime, size, path in files:
+                    if total_bytes <= target_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+                logger.debug("Evicted parse cache files, {} bytes left".format(total_bytes))
+            self._total_bytes = total_bytes
@@ -0,0 +1,76 @@
+# This module handles compressed graphml files
+# The output codec is configured in the [data] section:
+#   output_codec - none, gzip, xz or zstd
+#   output_level - the compression level, empty for the default of the codec
+# Compressed output files get the suffix of the codec (.graphml.gz, .graphml.xz, .graphml.zst).
+# On the reading side open_graphml recognizes the codec from the first bytes of the file,
+# so compressed and plain graphml inputs can be mixed.
+# zstd needs the zstandard package, gzip and xz are part of the standard library
+# The codec modules are imported when a file is first opened with them
+
+from collections import namedtuple
+
+OutputCodec = namedtuple('OutputCodec', ['name', 'level'])
+
+CODEC_SUFFIXES = {'none': '', 'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def get_output_codec(config):
+    codec_name = config['data'].get('output_codec', fallback='none').strip().lower() or 'none'
+    if codec_name not in CODEC_SUFFIXES:
+        raise Exception("Unknown output_codec {}, use one of {}".format(codec_name, ", ".join(CODEC_SUFFIXES.keys())))
+    level = config['data'].get('output_level', fallback='').strip()
+    return OutputCodec(codec_name, int(level) if level else None)
+
+def get_codec_suffix(codec):
+    if codec is None:
+        return ''
+    return CODEC_SUFFIXES[codec.name]
+
+def is_graphml_file(filename):
+    # plain or compressed graphml file
+    for suffix in CODEC_SUFFIXES.values():
+        if filename.endswith('.graphml' + suffix):
+            return True
+    return False
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("The zstd codec needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+def open_output(path, codec):
+    # returns a binary file object, the data written to it is compressed with the codec
+    if codec is None or codec.name == 'none':
+        return open(path, 'wb')
+    if codec.name == 'gzip':
+        import gzip
+        return gzip.open(path, 'wb', compresslevel=codec.level if codec.level is not None else 6)
+    if codec.name == 'xz':
+        import lzma
+        return lzma.open(path, 'wb', preset=codec.level)
+    if codec.name == 'zstd':
+        zstandard = _import_zstandard()
+        compressor = zstandard.ZstdCompressor(level=codec.level if codec.level is not None else 3)
+        return compressor.stream_writer(open(path, 'wb'), closefd=True)
+    raise Exception("Unknown output codec {}".format(codec.name))
+
+def open_graphml(path):
+    # returns a binary file object with the decompressed content of a plain or compressed graphml file
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(GZIP_MAGIC):
+        import gzip
+        return gzip.open(path, 'rb')
+    if magic.startswith(XZ_MAGIC):
+        import lzma
+        return lzma.open(path, 'rb')
+    if magic.startswith(ZSTD_MAGIC):
+        zstandard = _import_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
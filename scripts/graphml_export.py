@@ -0,0 +1,54 @@
+# This module downloads the graphml of a network straight into a file
+# Network.graphML() of pysbml4j reads the whole response into memory and decodes it into a string.
+# download_graphml instead streams the response of the same endpoint to the output file in chunks,
+# so the network is fetched exactly once and memory stays bounded for very large context networks.
+# The file is written under a temporary name and renamed when complete, so an interrupted
+# download never leaves a truncated graphml file behind.
+# With an output codec the chunks are compressed while they are written
+
+import os
+import time
+
+from graphml_codec import get_codec_suffix
+from graphml_codec import open_output
+
+def download_graphml(net, output_file, directed=None, chunk_size=1024*1024, timings=None, codec=None):
+    # returns the name of the written file, which is output_file with the suffix of the codec
+    # if timings is given, the seconds spent downloading and writing are added under 'graphml' and 'write'
+    client = net.sbml4jApi
+    client.checkSyncStatus()
+    urlString = "{}/networks/{}".format(client.configuration.url, net.uuid)
+    if directed != None:
+        urlString = urlString + "?directed={}".format(directed)
+    # copy the headers, the client headers are shared with other requests
+    headers = dict(client.configuration.headers)
+    headers['Accept'] = 'application/octet-stream'
+
+    start_time = time.perf_counter()
+    write_time = 0.0
+    output_file = output_file + get_codec_suffix(codec)
+    response = client._pm.request("GET", urlString, headers=headers, preload_content=False)
+    try:
+        if response.status > 399:
+            if not 'reason' in response.headers.keys():
+                raise Exception("Unknown Error fetching resource: HttpStatus: {}; Header of response: {}".format(response.status, response.headers))
+            else:
+                raise Exception("Could not get resource. Reason: {}".format(response.headers['reason']))
+        part_file = "{}.part".format(output_file)
+        try:
+            with open_output(part_file, codec) as f:
+                for chunk in response.stream(chunk_size):
+                    write_start = time.perf_counter()
+                    f.write(chunk)
+                    write_time += time.perf_counter() - write_start
+        except:
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            raise
+        os.replace(part_file, output_file)
+    finally:
+        response.release_conn()
+    if timings is not None:
+        timings['graphml'] = timings.get('graphml', 0.0) + time.perf_counter() - start_time - write_time
+        timings['write'] = timings.get('write', 0.0) + write_time
+    return output_file
@@ -0,0 +1,61 @@
+# This module spreads the parsing of graphml files over a pool of worker processes
+# Each worker reads one file with the streaming reader and only sends a compact result
+# back to the parent process:
+#   symbols - the list of node symbols in file order (one entry per node, duplicates included),
+#             nodes with an empty symbol are left out, so the symbol index and a pass over the files count the same
+#   attributes - for each requested node property, a map of node symbol to property value
+# The results are returned in the order of the input files, so aggregating them
+# in the parent gives exactly the same counts as the sequential loop
+
+import os
+
+from collections import namedtuple
+
+from graphml_reader import read_graphml
+from annotations import get_symbol_annotation_maps
+
+IngestResult = namedtuple('IngestResult', ['file', 'symbols', 'attributes'])
+
+def get_ingest_workers(config):
+    # number of worker processes from the [data] section, defaults to the number of cpus
+    workers = config['data'].getint('ingest_workers', fallback=0)
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    return workers
+
+def create_ingest_executor(workers):
+    # with a single worker the files are parsed in the calling process
+    if workers <= 1:
+        return None
+    # imported here, multiprocessing is only needed with more than one worker
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers)
+
+def ingest_graphml_file(current_file, name_to_type_map=None, node_properties=None, cache=None):
+    with_attributes = bool(node_properties)
+    if cache is not None:
+        graphml_content = cache.read(current_file, name_to_type_map)
+    else:
+        graphml_content = read_graphml(current_file, name_to_type_map, with_attributes=with_attributes)
+    symbols = [symbol for symbol in graphml_content.id_to_symbol_map.values() if symbol is not None]
+    attributes = {}
+    if with_attributes:
+        attributes = get_symbol_annotation_maps(graphml_content.node_attributes, node_properties)
+    return IngestResult(current_file, symbols, attributes)
+
+def _ingest_graphml_file(args):
+    return ingest_graphml_file(*args)
+
+def ingest_graphml_files(executor, graphml_files, name_to_type_map=None, node_properties=None, cache=None):
+    # parse all given files, in parallel if an executor is given, and return the results in input order
+    # with a cache, files that have been parsed in an earlier run are not parsed again
+    work = [(current_file, name_to_type_map, node_properties, cache) for current_file in graphml_files]
+    if executor is None:
+        return [_ingest_graphml_file(args) for args in work]
+    # hand out several small files at once to keep the inter-process overhead low
+    chunksize = max(1, len(work) // ((os.cpu_count() or 1) * 4))
+    results = list(executor.map(_ingest_graphml_file, work, chunksize=chunksize))
+    if cache is not None:
+        # the workers only write to the cache, it is evicted here
+        cache.evict()
+    return results
@@ -0,0 +1,79 @@
+# This module reads the DeRegNet graphml files in a single streaming pass
+# It replaces the ET.parse + get_key_mapping + get_id_to_symbol_map + get_node_data_elements combination
+# The file is parsed incrementally with iterparse, every node and edge element is dropped
+# from the tree as soon as its data has been collected, so the peak memory stays roughly
+# flat no matter how big the graphml file is
+# Compressed graphml files (gzip, xz, zstd) are decompressed while they are read
+
+from collections import namedtuple
+
+import xml.etree.ElementTree as ET
+
+from graphml_codec import open_graphml
+
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+KEY_TAG = GRAPHML_NS + 'key'
+NODE_TAG = GRAPHML_NS + 'node'
+EDGE_TAG = GRAPHML_NS + 'edge'
+DATA_TAG = GRAPHML_NS + 'data'
+
+# The result of reading one graphml file
+#   key_mapping - the key id to attr.name mapping of the key elements
+#   id_to_symbol_map - node id to the value of its 'symbol' data element
+#   node_attributes - node id to the map of all its (typed) data elements,
+#                     empty if the file was read without attributes
+GraphMLContent = namedtuple('GraphMLContent', ['key_mapping', 'id_to_symbol_map', 'node_attributes'])
+
+def get_node_data_elements(node_object, key_mapping, name_to_type_map):
+    node_attribute_map = {}
+    for data in node_object.iter(DATA_TAG):
+        data_name = key_mapping[data.attrib['key']]
+        if data_name in name_to_type_map:
+            data_type = name_to_type_map[data_name]
+            if data_type == 'double' or data_type == 'float':
+                node_attribute_map[data_name] = float(data.text)
+            else:
+                node_attribute_map[data_name] = data.text
+        else:
+            node_attribute_map[data_name] = data.text
+    return node_attribute_map
+
+def read_graphml(source, name_to_type_map=None, with_attributes=True):
+    # source can be a filename or a file object opened in binary mode
+    if isinstance(source, str):
+        with open_graphml(source) as f:
+            return read_graphml(f, name_to_type_map, with_attributes)
+    if name_to_type_map is None:
+        name_to_type_map = {}
+    key_mapping = {}
+    id_to_symbol_map = {}
+    node_attributes = {}
+    # the currently open elements, the last one is the parent of the element that ends next
+    open_elements = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            open_elements.append(elem)
+            continue
+        open_elements.pop()
+        tag = elem.tag
+        if tag == KEY_TAG:
+            key_mapping[elem.attrib['id']] = elem.attrib['attr.name']
+        elif tag == NODE_TAG:
+            node_id = elem.attrib['id']
+            if with_attributes:
+                node_attribute_map = get_node_data_elements(elem, key_mapping, name_to_type_map)
+                node_attributes[node_id] = node_attribute_map
+                if 'symbol' in node_attribute_map:
+                    id_to_symbol_map[node_id] = node_attribute_map['symbol']
+            else:
+                for data in elem.iter(DATA_TAG):
+                    if key_mapping[data.attrib['key']] == 'symbol':
+                        id_to_symbol_map[node_id] = data.text
+        elif tag != EDGE_TAG:
+            # data elements are needed by their node, everything else is small
+            continue
+        # free the node or edge, and unlink it from its graph element
+        elem.clear()
+        if open_elements:
+            open_elements[-1].remove(elem)
+    return GraphMLContent(key_mapping, id_to_symbol_map, node_attributes)
@@ -0,0 +1,157 @@
+# This module keeps a manifest of the graphml input files a script has processed, for incremental runs
+# For every input file the manifest holds its size, mtime and sha256, and the output files written for it.
+# Outputs written for a group of files (e.g. a file_pattern of a folder) are kept per unit_key instead.
+# A run compares the files in /graphml with the manifest and only processes what has been added,
+# changed or removed since the last run, instead of the whole directory:
+#   - a file whose size and mtime are unchanged is not looked at again
+#   - a file with a new size or mtime but the same content (e.g. copied again) only gets its new stats recorded
+# Files modified less than settle_time seconds ago may still be written to, they are left for the next pass.
+# The manifest is stored per script in input_manifest.sqlite in the output_dir.
+# Configured in the [incremental] section:
+#   enabled - run incrementally, also enabled by --incremental or --watch on the command line
+#   interval - seconds between two passes of the watch loop (--watch)
+#   settle_time - seconds a file must be unchanged before it is processed
+
+import os
+import json
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+from run_journal import get_file_sha256
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FileState = namedtuple('FileState', ['size', 'mtime_ns'])
+
+# added, changed, removed - the keys of the files, changed files have a different content than recorded
+# states - the FileState of every settled file, unsettled - the number of files left for the next pass
+ManifestChanges = namedtuple('ManifestChanges', ['added', 'changed', 'removed', 'states', 'unsettled'])
+
+def is_incremental(config, sysArgs):
+    return '--incremental' in sysArgs or '--watch' in sysArgs or config.getboolean('incremental', 'enabled', fallback=False)
+
+def get_input_manifest(config, script):
+    manifest_file = os.path.join(config['data'].get('output_dir'), 'input_manifest.sqlite')
+    return InputManifest(manifest_file, script, config.getfloat('incremental', 'settle_time', fallback=2.0))
+
+def get_watch_interval(config):
+    return config.getfloat('incremental', 'interval', fallback=5.0)
+
+def watch(run_pass, interval):
+    # runs run_pass every interval seconds until interrupted, a failing pass is logged and tried again
+    logger.info("Watching for changed input files every {} seconds".format(interval))
+    try:
+        while True:
+            try:
+                run_pass()
+            except Exception:
+                logger.exception("Incremental pass failed, trying again in {} seconds".format(interval))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+
+class InputManifest(object):
+
+    def __init__(self, manifest_file, script, settle_time=2.0):
+        self.script = script
+        self.settle_time = settle_time
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(manifest_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (script TEXT, file_key TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, "
+                         "sha256 TEXT, output_files TEXT, processed_at REAL, PRIMARY KEY (script, file_key))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS outputs (script TEXT, unit_key TEXT, output_files TEXT, written_at REAL, "
+                         "PRIMARY KEY (script, unit_key))")
+        self._db.commit()
+
+    def _get_recorded(self):
+        with self._lock:
+            rows = self._db.execute("SELECT file_key, path, size, mtime_ns, sha256 FROM files WHERE script = ?", (self.script,)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def get_changes(self, files):
+        # files maps the key of every current input file to its path
+        recorded = self._get_recorded()
+        now = time.time()
+        changes = ManifestChanges([], [], [], {}, 0)
+        for file_key, path in files.items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed since it was listed, the next pass sees it as removed
+                continue
+            if now - stat.st_mtime < self.settle_time:
+                changes = changes._replace(unsettled=changes.unsettled + 1)
+                continue
+            state = FileState(stat.st_size, stat.st_mtime_ns)
+            changes.states[file_key] = state
+            entry = recorded.get(file_key)
+            if entry is None:
+                changes.added.append(file_key)
+            elif (entry[1], entry[2]) != state:
+                if get_file_sha256(path) != entry[3]:
+                    changes.changed.append(file_key)
+                else:
+                    # the same content, only the stats have changed
+                    self.record(file_key, path, state, self.get_output_files(file_key))
+        for file_key in recorded:
+            if file_key not in files:
+                changes.removed.append(file_key)
+        return changes
+
+    def get_output_files(self, file_key):
+        with self._lock:
+            row = self._db.execute("SELECT output_files FROM files WHERE script = ? AND file_key = ?", (self.script, file_key)).fetchone()
+        return json.loads(row[0]) if row is not None else []
+
+    def get_shared_output_files(self, file_key):
+        # the output files of the given file that are also recorded for another input file
+        output_files = self.get_output_files(file_key)
+        with self._lock:
+            rows = self._db.execute("SELECT output_files FROM files WHERE script = ? AND file_key != ?", (self.script, file_key)).fetchall()
+        other_output_files = set()
+        for row in rows:
+            other_output_files.update(json.loads(row[0]))
+        return [output_file for output_file in output_files if output_file in other_output_files]
+
+    def record(self, file_key, path, state, output_files=None):
+        # marks the file as processed in the given state, with the outputs written for it
+        sha256 = get_file_sha256(path)
+        stat = os.stat(path)
+        if FileState(stat.st_size, stat.st_mtime_ns) != state:
+            # changed while it was processed, without a hash the next pass processes it again
+            sha256 = None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (self.script, file_key, path, state.size, state.mtime_ns, sha256, json.dumps(output_files or []), time.time()))
+            self._db.commit()
+
+    def remove(self, file_key):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE script = ? AND file_key = ?", (self.script, file_key))
+            self._db.commit()
+
+    def get_unit_output_files(self, unit_key):
+        with self._lock:
+            row = self._db.execute("SELECT output_files FROM outputs WHERE script = ? AND unit_key = ?", (self.script, unit_key)).fetchone()
+        return json.loads(row[0]) if row is not None else []
+
+    def record_unit(self, unit_key, output_files):
+        # the outputs written for a group of input files
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)", (self.script, unit_key, json.dumps(output_files), time.time()))
+            self._db.commit()
+
+    def remove_unit(self, unit_key):
+        with self._lock:
+            self._db.execute("DELETE FROM outputs WHERE script = ? AND unit_key = ?", (self.script, unit_key))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -5,48 +5,53 @@
 # SBML4j can reuse parts of the database results then.
 # It might be necessary to also evaluate the database query times, and in general times on the server side, not only client
 # The timing data is put in the graphml files that are generated
+# and, for every phase of creating a context, in the results store (benchmark_results.jsonl/.sqlite in the output_dir)
 
 import os
 import sys
+import time
 
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+from client_pool import get_client_pool
 
 import logging
-from logging.config import fileConfig
-import configparser
 
-import xml.etree.ElementTree as ET
-
-from codetiming import Timer
+from settings import get_config
+from settings import init_logging
+from settings import abbreviate
 
 from random import seed
 from random import randint
 from random import choices
 
+from context_load import ContextTask
+from context_load import ContextResult
+from context_load import run_concurrent
+from context_load import summarize_latencies
+from context_load import format_summary
+
+from network_session import get_network_session
+
+from results_store import get_results_store
+from results_store import phase_timer
+
+from run_journal import get_run_journal
+
+from resilience import get_resilience
+
+from context_memo import get_context_memo
+
+from graphml_export import download_graphml
+from graphml_codec import get_output_codec
+
 
-# global definitions for the log-config
-configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
 
-# global definition for the sbml4j-config
-config = configparser.ConfigParser()
-config.read('{}/config.ini'.format(configFolder))
+# global definition for the sbml4j-config, read on first use
+config = get_config()
 
 def init_sbml4j(user=None):
-
-    server_conf = config['server']
-    host = server_conf.get('host')
-    if not host.startswith('http'):
-        host = "{}{}".format("http://", host)
-    if user != None:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context'), user=user))
-        return client
-    else:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context')))
-        return client
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
 
 def get_key_mapping(root):
     key_mapping = {}
@@ -109,9 +114,91 @@ def draw_elements(all_elements, number_to_draw):
         returnList.append(all_elements[list_index])
     return returnList
 
+def build_context_plan(network_nodeSymbols, num_iter, max_symbol_count, contextMinSize, contextMaxSize):
+    # draws the symbols of all iterations and sizes up front, in the order of the sequential loop
+    tasks = []
+    for iteration in range(1,num_iter+1):
+        for context_size in range(1, max_symbol_count+1):
+            context_symbols = draw_elements(network_nodeSymbols, context_size)
+            tasks.append(ContextTask(iteration, context_size, contextMinSize, contextMaxSize, context_symbols))
+    return tasks
+
+def get_unit(task):
+    # the unit of work in the run journal
+    return {'iteration': task.iteration, 'context_size': task.context_size}
+
+def run_context_task(client, session, store, journal, resilience, memo, base_name, output_dir, task, timings=None):
+    # creates the context of one planned task and records it in the results store and the run journal
+    # the server calls are retried by resilience, the retries end up in the row of the context
+    if timings is None:
+        timings = {}
+    row = {'iteration': task.iteration, 'context_size': task.context_size, 'min_size': int(task.min_size), 'max_size': int(task.max_size),
+           'symbol_count': len(task.symbols), 'symbols': task.symbols, 'started_at': time.time(), 'timings': timings}
+    name_of_network = "size-{}-iter-{}_{}_{}-{}".format(task.context_size, task.iteration, task.symbols, task.min_size, task.max_size)
+    # imported here, codetiming is only needed once a context is created
+    from codetiming import Timer
+    # the time is logged with the context below, not printed by the timer
+    t = Timer("context_timer_{}_{}".format(task.context_size, task.iteration), logger=None)
+    try:
+        with phase_timer(timings, 'get_network'):
+            net = resilience.call(session.get_network, client, base_name, stats=row)
+        t.start()
+        memo_entry = None
+        with phase_timer(timings, 'create_context'):
+            if memo is not None:
+                memo_entry = memo.create_context(net, task.symbols, task.min_size, task.max_size, networkname=name_of_network, resilience=resilience, stats=row)
+                row['memo_hit'] = memo_entry.reused
+            else:
+                resilience.call(net.createContext, task.symbols, networkname=name_of_network, minSize=task.min_size, maxSize=task.max_size, stats=row)
+        elapsed_time = t.stop()
+        logger.info("Created network context for %s with timer %s which took %s seconds", abbreviate(task.symbols), t, elapsed_time)
+        row.update({'network_name': net.name, 'node_count': net.numberOfNodes, 'edge_count': net.numberOfRelations})
+        filename="size-{}-iter-{}-time-{:0.4f}-{}.graphml".format(task.context_size, task.iteration, elapsed_time, net.name)
+        output_file=os.path.join(output_dir, filename)
+        # stream the graphml to the file, download and write times are recorded separately
+        if memo_entry is not None and memo_entry.output_file is not None:
+            row['output_file'] = memo_entry.output_file
+        else:
+            row['output_file'] = resilience.call(download_graphml, net, output_file, timings=timings, codec=get_output_codec(config), stats=row)
+            if memo_entry is not None:
+                memo.remember_output(memo_entry.key, row['output_file'])
+        row['success'] = True
+        result = ContextResult(task, True, elapsed_time)
+    except Exception as e:
+        logger.info("Skipping context for %s, as it could not be generated: %s", name_of_network, e)
+        row['success'] = False
+        row['error'] = str(e)
+        result = ContextResult(task, False, 0.0)
+    store.add(row)
+    if result.success and journal is not None:
+        journal.record(output_file=row['output_file'], **get_unit(task))
+    return result
+
+def run_concurrent_plan(client, session, store, journal, resilience, memo, base_name, output_dir, workers, num_iter, max_symbol_count, contextMinSize, contextMaxSize, max_failures=None):
+    # get all symbols once, the whole plan is drawn before any context is created
+    network_nodeSymbols = resilience.call(session.get_node_symbols, client, base_name)
+    tasks = build_context_plan(network_nodeSymbols, num_iter, max_symbol_count, contextMinSize, contextMaxSize)
+    if journal is not None:
+        # the draws are the same as in the interrupted run, only the unfinished tasks are run
+        tasks = [task for task in tasks if not journal.is_done(**get_unit(task))]
+    # every worker thread gets its own client from the pool
+    run_task = lambda task: run_context_task(resilience.call(init_sbml4j, user = client.user), session, store, journal, resilience, memo, base_name, output_dir, task)
+    return run_concurrent(tasks, run_task, workers, max_failures)
+
 def main(sysArgs):
+    init_logging()
     logger.debug("This script generates contexts for random sets of gene-symbols of the base network provided in the config file")
-    client = init_sbml4j(user = "contextcreationtimer")
+    # transient server errors are retried, a failing server pauses the run
+    resilience = get_resilience(config)
+    client = resilience.call(init_sbml4j, user = "contextcreationtimer")
+    # repeated requests reuse their context network, only if [memo] benchmarks is set
+    memo = get_context_memo(config, benchmark=True)
+    # the base network and its symbols are only fetched once per session
+    session = get_network_session(config)
+    # one row with the timings of all phases per context
+    store = get_results_store(config, "iter_size_in_order_context_gen")
+    # finished contexts of an interrupted run are skipped
+    journal = get_run_journal(config, "iter_size_in_order_context_gen")
     # get the output_dir
     output_dir = config['data'].get('output_dir')
     # intialize the random number generator
@@ -123,32 +210,53 @@ def main(sysArgs):
     num_iter = config.getint('loop', 'iter')
     # get the max number of symbols
     max_symbol_count = config.getint('loop', 'size')
+    # get the number of concurrent clients, 1 creates the contexts one at a time
+    workers = config['loop'].getint('workers', fallback=1)
+    # the run is given up after this many failed contexts
+    max_failures = config.getint('resilience', 'max_failures', fallback=10)
+    if workers > 1:
+        results, wall_time = run_concurrent_plan(client, session, store, journal, resilience, memo, base_name, output_dir, workers, num_iter, max_symbol_count, 0, 2, max_failures)
+        logger.info("Concurrent run with {} workers for minSize/maxSize 0/2: {}".format(workers, format_summary(summarize_latencies(results, wall_time))))
+        store.close()
+        if journal is not None:
+            journal.close()
+        if memo is not None:
+            memo.close()
+        return
+    results = []
+    start_time = time.perf_counter()
+    failures = 0
     for iteration in range(1,num_iter+1):
+        if failures >= max_failures:
+            break
         for context_size in range(1, max_symbol_count+1):
-            # get the base network
-            net = client.getNetworkByName(base_name)
+            timings = {}
             # get all symbols
-            network_nodeSymbols = net.getOptions()['filter']['nodeSymbols']
+            with phase_timer(timings, 'get_options'):
+                network_nodeSymbols = resilience.call(session.get_node_symbols, client, base_name)
             context_symbols = draw_elements(network_nodeSymbols, context_size)
 
-            # create context
+            # create context and download it
             contextMinSize=0
             contextMaxSize=2
-            # initialize the timer
-            t = Timer("context_timer_{}_{}".format(context_size, iteration))
-            t.start()
-            # calculate the actual context
-            try:
-                name_of_network = "size-{}-iter-{}_{}_{}-{}".format(context_size, iteration, context_symbols, contextMinSize, contextMaxSize)
-                net.createContext(context_symbols, networkname=name_of_network, minSize=contextMinSize, maxSize=contextMaxSize)
-                elapsed_time = t.stop()
-                logger.info("Created network context for {} with timer {} which took {} seconds".format(context_symbols, t, elapsed_time))
-                filename="size-{}-iter-{}-time-{:0.4f}-{}.graphml".format(context_size, iteration, elapsed_time, net.name)
-                output_file=os.path.join(output_dir, filename)
-                with open(output_file, 'w') as f:
-                    f.write(net.graphML())
-            except:
-                logger.info("Skipping context for {}, as it could not be generated".format(name_of_network))
+            task = ContextTask(iteration, context_size, contextMinSize, contextMaxSize, context_symbols)
+            if journal is not None and journal.is_done(**get_unit(task)):
+                logger.info("Skipping size %s of iteration %s, it has been finished before", context_size, iteration)
+                continue
+            result = run_context_task(client, session, store, journal, resilience, memo, base_name, output_dir, task, timings)
+            results.append(result)
+            if not result.success:
+                failures += 1
+                if failures >= max_failures:
+                    logger.error("Giving up on minSize/maxSize 0/2 after {} failed contexts".format(failures))
+                    break
+    wall_time = time.perf_counter() - start_time
+    logger.info("Sequential run for minSize/maxSize 0/2: {}".format(format_summary(summarize_latencies(results, wall_time))))
+    store.close()
+    if journal is not None:
+        journal.close()
+    if memo is not None:
+        memo.close()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,101 @@
+# This module keeps a client side cache of network lookups and network options
+# The benchmark loops and the per-file script look up the base network and download its
+# options (with the full list of node symbols) for every context they create.
+# The session remembers both per (user, network name) for ttl seconds, so that
+# steady-state iterations only send the createContext request.
+# The cache can be invalidated explicitly, e.g. after the base network has been changed
+# NetworkListCache keeps the uuids of the networks on the server per user, for the checks of the
+# context memo and the annotation ledger; the list is downloaded once per pass instead of for every check
+
+import threading
+import time
+
+def get_network_session(config):
+    # the time to live from the [session] section, 0 keeps the entries until they are invalidated
+    ttl = 0
+    if config.has_section('session'):
+        ttl = config['session'].getfloat('ttl', fallback=0)
+    return NetworkSession(ttl)
+
+class NetworkSession(object):
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._network_infos = {}
+        self._options = {}
+
+    def _get_valid(self, cache, key):
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        timestamp, value = entry
+        if self.ttl > 0 and time.monotonic() - timestamp > self.ttl:
+            del cache[key]
+            return None
+        return value
+
+    def get_network(self, client, name):
+        # returns a new Network object for every call, as createContext, annotate etc.
+        # change the Network object they are called on to the newly created network
+        key = (client.user, name)
+        with self._lock:
+            network_info = self._get_valid(self._network_infos, key)
+        if network_info is None:
+            network_info = client.getNetworkByName(name).getInfoDict()
+            with self._lock:
+                self._network_infos[key] = (time.monotonic(), network_info)
+        # imported here, pysbml4j is loaded with the first client anyway
+        from pysbml4j import Network
+        return Network(dict(network_info), client)
+
+    def get_options(self, client, name):
+        # the returned options are shared between all callers and must not be changed
+        key = (client.user, name)
+        with self._lock:
+            options = self._get_valid(self._options, key)
+        if options is None:
+            options = self.get_network(client, name).getOptions()
+            with self._lock:
+                self._options[key] = (time.monotonic(), options)
+        return options
+
+    def get_node_symbols(self, client, name):
+        return self.get_options(client, name)['filter']['nodeSymbols']
+
+    def invalidate(self, user=None, name=None):
+        # drop the cached entries matching the given user and/or network name, all entries if none is given
+        with self._lock:
+            for cache in (self._network_infos, self._options):
+                for key in list(cache.keys()):
+                    if (user is None or key[0] == user) and (name is None or key[1] == name):
+                        del cache[key]
+
+class NetworkListCache(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._uuids = {}
+
+    def exists(self, client, uuid):
+        # True if the network is on the server, the network list of the user is only downloaded on the first call
+        with self._lock:
+            uuids = self._uuids.get(client.user)
+        if uuids is None:
+            client.refreshNetworkList()
+            uuids = set(network.uuid for network in client.networkMap.values())
+            with self._lock:
+                self._uuids[client.user] = uuids
+        return uuid in uuids
+
+    def add(self, client, uuid):
+        # a network created after the list has been downloaded
+        with self._lock:
+            uuids = self._uuids.get(client.user)
+            if uuids is not None:
+                uuids.add(uuid)
+
+    def clear(self):
+        # the next check downloads the network list again, called at the start of every pass
+        with self._lock:
+            self._uuids.clear()
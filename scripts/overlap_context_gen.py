@@ -0,0 +1,103 @@
+# This is the benchmarking script that measures how much SBML4j gains from similar consecutive context requests
+# SBML4j can reuse parts of the database results when the node list of a context is similar to the one
+# of the context before it (see iter_size_in_order_context_gen.py). This script creates sequences of contexts
+# whose symbol sets overlap by a configured Jaccard index with their predecessor, for every level in
+# [overlap] levels, from disjoint (0) to the same set again (1), see overlap_workload.py.
+# Every context is recorded in the results store with its overlap; the latency versus overlap
+# is logged and written to overlap_report_<run_id>.json in the output_dir
+
+import os
+import sys
+import time
+import json
+
+from client_pool import get_client_pool
+
+import logging
+
+from settings import get_config
+from settings import init_logging
+
+from context_load import ContextResult
+from network_session import get_network_session
+from results_store import get_results_store
+from results_store import phase_timer
+from resilience import get_resilience
+from overlap_workload import generate_overlap_workload
+from overlap_workload import summarize_overlap_latencies
+from overlap_workload import format_overlap_summary
+
+logger = logging.getLogger()
+
+# global definition for the sbml4j-config, read on first use
+config = get_config()
+
+def init_sbml4j(user=None):
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
+
+def run_overlap_task(client, session, store, resilience, base_name, task, iteration, min_size, max_size):
+    timings = {}
+    row = {'iteration': iteration, 'context_size': len(task.symbols), 'min_size': min_size, 'max_size': max_size,
+           'symbol_count': len(task.symbols), 'symbols': task.symbols, 'started_at': time.time(), 'timings': timings,
+           'overlap': task.overlap}
+    name_of_network = "overlap-{}-sequence-{}-position-{}".format(task.level, task.sequence, task.position)
+    try:
+        with phase_timer(timings, 'get_network'):
+            net = resilience.call(session.get_network, client, base_name, stats=row)
+        with phase_timer(timings, 'create_context'):
+            resilience.call(net.createContext, task.symbols, networkname=name_of_network, minSize=min_size, maxSize=max_size, stats=row)
+        row.update({'network_name': net.name, 'node_count': net.numberOfNodes, 'edge_count': net.numberOfRelations})
+        row['success'] = True
+    except Exception as e:
+        logger.info("Skipping context {}, as it could not be generated: {}".format(name_of_network, e))
+        row['success'] = False
+        row['error'] = str(e)
+    store.add(row)
+    # a retried context includes the backoff, it does not count as a measurement
+    return ContextResult(task, row['success'] and not row.get('retries'), timings.get('create_context', 0.0))
+
+def main(sysArgs):
+    init_logging()
+    logger.debug("This script generates sequences of contexts with a given overlap between neighbouring symbol sets")
+    # transient server errors are retried, a failing server pauses the run
+    resilience = get_resilience(config)
+    client = resilience.call(init_sbml4j, user = "contextcreationtimer")
+    # the base network and its symbols are only fetched once per session
+    session = get_network_session(config)
+    # one row with the timings of all phases per context
+    store = get_results_store(config, "overlap_context_gen")
+    # get the output_dir
+    output_dir = config['data'].get('output_dir')
+    # get the base network name from config
+    base_name = config['network'].get('base_name')
+
+    overlap_conf = config['overlap']
+    levels = [float(level) for level in overlap_conf.get('levels', fallback='0,0.25,0.5,0.75,0.9,1').split(',')]
+    size = overlap_conf.getint('size', fallback=20)
+    length = overlap_conf.getint('length', fallback=20)
+    sequences = overlap_conf.getint('sequences', fallback=3)
+    min_size = overlap_conf.getint('min_size', fallback=0)
+    max_size = overlap_conf.getint('max_size', fallback=2)
+
+    network_nodeSymbols = resilience.call(session.get_node_symbols, client, base_name)
+    tasks = generate_overlap_workload(network_nodeSymbols, levels, size, length, sequences, int(config['random'].get('seed')))
+    logger.info("Creating {} contexts of {} symbols in {} sequences for the overlaps {}".format(len(tasks), size, len(levels) * sequences, levels))
+
+    results = []
+    for iteration, task in enumerate(tasks, 1):
+        results.append(run_overlap_task(client, session, store, resilience, base_name, task, iteration, min_size, max_size))
+    store.close()
+
+    summaries = summarize_overlap_latencies(results)
+    for summary in summaries:
+        logger.info(format_overlap_summary(summary))
+    report_file = os.path.join(output_dir, "overlap_report_{}.json".format(store.run_id))
+    with open(report_file, 'w') as f:
+        json.dump({'run_id': store.run_id, 'size': size, 'length': length, 'sequences': sequences,
+                   'min_size': min_size, 'max_size': max_size, 'levels': summaries}, f, indent=2)
+    logger.info("Wrote latency versus overlap report {}".format(report_file))
+
+if __name__ == "__main__":
+
+    main(sys.argv)
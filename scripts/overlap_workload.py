@@ -0,0 +1,76 @@
+# This module generates sequences of symbol sets with a given overlap between neighbouring sets
+# The overlap is the Jaccard index |A & B| / |A | B| of two consecutive sets. For sets of the same
+# size k sharing m symbols it is m / (2k - m), so for a target overlap J the next set keeps
+# m = round(2kJ / (1 + J)) randomly chosen symbols of the previous one and adds k - m symbols
+# that were not in it. J = 0 gives disjoint neighbours, J = 1 the same set again.
+# The first set of every sequence is drawn fresh and has no defined overlap (overlap None).
+# summarize_overlap_latencies turns the measured context times into latency versus overlap
+
+from collections import namedtuple
+
+import numpy as np
+
+from context_load import percentile
+
+# level - the target overlap of the sequence
+# sequence - the number of the sequence, position - the position in it, starting with 0
+# overlap - the Jaccard index with the previous set of the sequence, None for the first one
+OverlapTask = namedtuple('OverlapTask', ['level', 'sequence', 'position', 'symbols', 'overlap'])
+
+def get_shared_count(size, level):
+    return int(round(2 * size * level / (1 + level)))
+
+def jaccard(shared, size):
+    return shared / float(2 * size - shared)
+
+def generate_sequence(rng, symbols, size, level, length, sequence):
+    # one sequence of length sets of size symbols, neighbours overlap by level
+    shared = get_shared_count(size, level)
+    if size - shared > len(symbols) - size:
+        raise Exception("Sets of {} out of {} symbols cannot be disjoint enough for overlap {}".format(size, len(symbols), level))
+    all_indices = np.arange(len(symbols))
+    current = rng.choice(len(symbols), size=size, replace=False)
+    tasks = [OverlapTask(level, sequence, 0, [symbols[index] for index in current], None)]
+    for position in range(1, length):
+        kept = rng.choice(current, size=shared, replace=False)
+        added = rng.choice(np.setdiff1d(all_indices, current, assume_unique=True), size=size - shared, replace=False)
+        current = rng.permutation(np.concatenate([kept, added]))
+        tasks.append(OverlapTask(level, sequence, position, [symbols[index] for index in current], jaccard(shared, size)))
+    return tasks
+
+def generate_overlap_workload(symbols, levels, size, length, sequences, seed):
+    # sequences sequences for every level; the sequences run in random order, so that a drift of
+    # the server over the run does not end up as a difference between the levels
+    symbols = sorted(set(symbols))
+    rng = np.random.default_rng(np.random.SeedSequence(seed))
+    order = rng.permutation(np.repeat(np.arange(len(levels)), sequences))
+    tasks = []
+    for sequence, level_index in enumerate(order):
+        tasks.extend(generate_sequence(rng, symbols, size, levels[level_index], length, sequence))
+    return tasks
+
+def summarize_overlap_latencies(results):
+    # results are (OverlapTask, success, elapsed), the first set of each sequence is left out
+    latencies = {}
+    overlaps = {}
+    for task, success, elapsed in results:
+        if task.overlap is None or not success:
+            continue
+        latencies.setdefault(task.level, []).append(elapsed)
+        overlaps[task.level] = task.overlap
+    summaries = []
+    baseline = None
+    for level in sorted(latencies.keys()):
+        level_latencies = sorted(latencies[level])
+        summary = {'level': level, 'overlap': overlaps[level], 'contexts': len(level_latencies),
+                   'mean': float(np.mean(level_latencies)), 'p50': percentile(level_latencies, 50),
+                   'p90': percentile(level_latencies, 90)}
+        if baseline is None:
+            baseline = summary['mean']
+        summary['speedup'] = baseline / summary['mean'] if summary['mean'] > 0 else float('nan')
+        summaries.append(summary)
+    return summaries
+
+def format_overlap_summary(summary):
+    return "overlap {:0.3f} (target {}): {} contexts, mean {:0.4f} s, p50 {:0.4f} s, p90 {:0.4f} s, {:0.2f}x the lowest overlap".format(
+        summary['overlap'], summary['level'], summary['contexts'], summary['mean'], summary['p50'], summary['p90'], summary['speedup'])
@@ -0,0 +1,43 @@
+# This module holds the parts of the client pool that need urllib3 and pysbml4j
+# It is imported by client_pool.py when the first pool is created, see there
+
+from urllib3 import PoolManager
+from urllib3 import Timeout
+from urllib3 import Retry
+
+from pysbml4j import Sbml4j
+from pysbml4j import Configuration
+
+from client_pool import set_last_status
+
+class StatusRecordingPoolManager(PoolManager):
+    # a PoolManager that remembers the status of the last response of every thread
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        response = super(StatusRecordingPoolManager, self).urlopen(method, url, redirect=redirect, **kw)
+        set_last_status(response.status)
+        return response
+
+class PooledSbml4j(Sbml4j):
+    # an Sbml4j client that sends its requests over the given PoolManager
+
+    def __init__(self, configuration, pool_manager):
+        self._pm = pool_manager
+        self._configuration = configuration
+        self.refreshNetworkList()
+        self._configuration.isInSync = True
+
+def create_pool_manager(num_pools, maxsize, block):
+    return StatusRecordingPoolManager(
+        num_pools=num_pools,
+        maxsize=maxsize,
+        block=block,
+        timeout=Timeout(connect=None, read=None),
+        retries=Retry(1, redirect=0))
+
+def create_client(host, port, application_context, user, pool_manager):
+    if user != None:
+        configuration = Configuration(host, port, application_context, user=user)
+    else:
+        configuration = Configuration(host, port, application_context)
+    return PooledSbml4j(configuration, pool_manager)
@@ -0,0 +1,168 @@
+# This module retries the calls to the SBML4j server and pauses a run while the server keeps failing
+# The errors raised by pysbml4j are classified as
+#   transient - no connection, timeouts and responses with status 429 or 5xx; these are retried
+#   permanent - everything else, e.g. a 4xx response for an unknown gene; these are raised right away
+# pysbml4j does not put the status into all of its exceptions, so the client pool records
+# the status of the last response of every thread (see client_pool.get_last_status).
+# Transient errors are retried up to [resilience] max_attempts times, waiting a random time
+# between 0 and backoff_base * 2^retry seconds (at most backoff_max) before each retry.
+# After breaker_threshold transient failures in a row, without a success in between, the circuit breaker
+# opens and every call waits breaker_pause seconds before going to the server again; if the first call
+# after the pause fails as well, the breaker opens again.
+# createContext and annotate create a new network on the server with every request, so retrying one that
+# failed with a timeout or a 5xx after reaching the server could create the network twice. These calls
+# (and any call with idempotent=False) are only retried if the request never reached the server:
+# the connection could not be opened, or the server turned it away with 429 or 503
+
+import random
+import socket
+import threading
+import time
+import re
+
+import logging
+
+from client_pool import get_last_status
+from client_pool import reset_last_status
+
+logger = logging.getLogger(__name__)
+
+STATUS_PATTERN = re.compile(r'HttpStatus: (\d{3})')
+
+# the calls that create a network on the server, not idempotent unless the caller says otherwise
+NON_IDEMPOTENT_CALLS = frozenset(['createContext', 'annotate'])
+# statuses the server answers without having processed the request
+UNPROCESSED_STATUSES = frozenset([429, 503])
+
+def get_resilience(config):
+    # one Resilience per run, its circuit breaker is shared by all threads
+    return Resilience(max_attempts=config.getint('resilience', 'max_attempts', fallback=4),
+                      backoff_base=config.getfloat('resilience', 'backoff_base', fallback=0.5),
+                      backoff_max=config.getfloat('resilience', 'backoff_max', fallback=30.0),
+                      breaker=CircuitBreaker(config.getint('resilience', 'breaker_threshold', fallback=5),
+                                             config.getfloat('resilience', 'breaker_pause', fallback=60.0)))
+
+def get_error_status(error):
+    # the http status of a failed request, or None if the request got no response
+    match = STATUS_PATTERN.search(str(error))
+    if match is not None:
+        return int(match.group(1))
+    return get_last_status()
+
+def is_transient(error):
+    # imported here, urllib3 is loaded with the first client anyway
+    from urllib3.exceptions import HTTPError
+    if isinstance(error, (HTTPError, ConnectionError, socket.timeout, TimeoutError)):
+        return True
+    status = get_error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+def is_unsent(error):
+    # True if the failed request provably never reached the server, so that it can be sent again
+    from urllib3.exceptions import ConnectTimeoutError
+    from urllib3.exceptions import MaxRetryError
+    if isinstance(error, MaxRetryError):
+        error = error.reason
+    # NewConnectionError (e.g. connection refused) is a ConnectTimeoutError
+    if isinstance(error, (ConnectTimeoutError, ConnectionRefusedError)):
+        return True
+    return get_error_status(error) in UNPROCESSED_STATUSES
+
+def is_idempotent(function):
+    return getattr(function, '__name__', None) not in NON_IDEMPOTENT_CALLS
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold, pause):
+        self.threshold = threshold
+        self.pause = pause
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # blocks while the breaker is open, returns the seconds waited
+        with self._lock:
+            opened_at = self._opened_at
+        if opened_at is None:
+            return 0.0
+        remaining = opened_at + self.pause - time.monotonic()
+        if remaining <= 0:
+            return 0.0
+        time.sleep(remaining)
+        return remaining
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("SBML4j server is answering again, closing the circuit breaker")
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures < self.threshold:
+                return
+            now = time.monotonic()
+            if self._opened_at is None or now >= self._opened_at + self.pause:
+                logger.warning("{} failed calls to the SBML4j server in a row, pausing for {} seconds".format(self._failures, self.pause))
+                self._opened_at = now
+
+class Resilience(object):
+
+    def __init__(self, max_attempts=4, backoff_base=0.5, backoff_max=30.0, breaker=None):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker if breaker is not None else CircuitBreaker(5, 60.0)
+        # the jitter must not consume numbers of the seeded global generator the scripts draw symbols with
+        self._random = random.Random()
+
+    def backoff(self, retry):
+        return self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+    def call(self, function, *args, stats=None, idempotent=None, **kwargs):
+        # calls function(*args, **kwargs) and retries transient errors
+        # if stats is given, the number of retries and the seconds spent waiting are added under 'retries' and 'backoff'
+        # idempotent - whether the call may be repeated after it reached the server, by default all but NON_IDEMPOTENT_CALLS
+        if idempotent is None:
+            idempotent = is_idempotent(function)
+        attempt = 1
+        while True:
+            waited = self.breaker.wait()
+            reset_last_status()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                _add_stats(stats, 0, waited)
+                if not is_transient(e):
+                    # the server answered, it just did not like the request
+                    if get_last_status() is not None:
+                        self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not idempotent and not is_unsent(e):
+                    logger.warning("Not retrying {}, the request may have been processed by the server: {}".format(getattr(function, '__name__', function), e))
+                    raise
+                if attempt >= self.max_attempts:
+                    logger.warning("Giving up on {} after {} attempts: {}".format(getattr(function, '__name__', function), attempt, e))
+                    raise
+                delay = self.backoff(attempt - 1)
+                logger.info("Transient error in {} (attempt {} of {}), retrying in {:0.2f} seconds: {}".format(
+                    getattr(function, '__name__', function), attempt, self.max_attempts, delay, e))
+                time.sleep(delay)
+                _add_stats(stats, 1, delay)
+                attempt += 1
+                continue
+            _add_stats(stats, 0, waited)
+            # calls answered from a local cache tell nothing about the server
+            if get_last_status() is not None:
+                self.breaker.record_success()
+            return result
+
+def _add_stats(stats, retries, backoff):
+    if stats is None:
+        return
+    stats['retries'] = stats.get('retries', 0) + retries
+    stats['backoff'] = stats.get('backoff', 0.0) + backoff
@@ -0,0 +1,115 @@
+# This module stores one row per created context, with the timing of every phase
+# The rows are appended to a JSONL file and inserted into a SQLite table with the same columns,
+# both named after the store in the output directory, e.g. /output/benchmark_results.jsonl and
+# /output/benchmark_results.sqlite, so that thousands of runs can be queried without
+# globbing the output filenames. All runs append to the same store and are told apart by run_id
+#
+# The phases are
+#   get_network - looking up the base network
+#   get_options - getting the node symbols of the base network
+#   create_context - the createContext call
+#   graphml - downloading the graphml of the context network
+#   write - writing the graphml to the output file
+# retries and backoff are the retried server calls of the context and the seconds spent waiting for them,
+# memo_hit is set if the context network was taken from the context memo,
+# endpoint names the server the context was created on when comparing two servers,
+# overlap is the Jaccard index of the symbols with those of the context before (overlap_context_gen.py)
+
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+PHASES = ('get_network', 'get_options', 'create_context', 'graphml', 'write')
+
+COLUMNS = (
+    ('run_id', 'TEXT'),
+    ('script', 'TEXT'),
+    ('started_at', 'REAL'),
+    ('iteration', 'INTEGER'),
+    ('context_size', 'INTEGER'),
+    ('min_size', 'INTEGER'),
+    ('max_size', 'INTEGER'),
+    ('symbol_count', 'INTEGER'),
+    ('symbols', 'TEXT'),
+    ('network_name', 'TEXT'),
+    ('node_count', 'INTEGER'),
+    ('edge_count', 'INTEGER'),
+    ('success', 'INTEGER'),
+    ('error', 'TEXT'),
+    ('output_file', 'TEXT'),
+    ('retries', 'INTEGER'),
+    ('backoff', 'REAL'),
+    ('memo_hit', 'INTEGER'),
+    ('endpoint', 'TEXT'),
+    ('overlap', 'REAL'),
+) + tuple(('t_{}'.format(phase), 'REAL') for phase in PHASES)
+
+COLUMN_NAMES = tuple(name for name, column_type in COLUMNS)
+
+@contextmanager
+def phase_timer(timings, phase):
+    # adds the elapsed seconds of the with-block to timings[phase], also if the block raises
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start_time
+
+def get_results_store(config, script, name='benchmark_results'):
+    return ResultsStore(config['data'].get('output_dir'), script, name)
+
+class ResultsStore(object):
+
+    def __init__(self, output_dir, script, name='benchmark_results', run_id=None):
+        self.script = script
+        self.run_id = run_id if run_id is not None else "{}-{}".format(time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+        self.jsonl_file = os.path.join(output_dir, "{}.jsonl".format(name))
+        self.sqlite_file = os.path.join(output_dir, "{}.sqlite".format(name))
+        self._lock = threading.Lock()
+        self._jsonl = open(self.jsonl_file, 'a')
+        self._db = sqlite3.connect(self.sqlite_file, check_same_thread=False)
+        # rows are committed one by one, keep that cheap
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ({})".format(
+            ", ".join("{} {}".format(name, column_type) for name, column_type in COLUMNS)))
+        # stores created before columns were added get them appended
+        existing_columns = set(column[1] for column in self._db.execute("PRAGMA table_info(results)"))
+        for name, column_type in COLUMNS:
+            if name not in existing_columns:
+                self._db.execute("ALTER TABLE results ADD COLUMN {} {}".format(name, column_type))
+        self._db.commit()
+        self._insert = "INSERT INTO results ({}) VALUES ({})".format(", ".join(COLUMN_NAMES), ", ".join('?' for name in COLUMN_NAMES))
+
+    def add(self, row):
+        # row is a dictionary with (some of) the columns, run_id and script are filled in,
+        # timings can be given as the dictionary filled by phase_timer
+        row = dict(row)
+        timings = row.pop('timings', {})
+        for phase, elapsed in timings.items():
+            row['t_{}'.format(phase)] = elapsed
+        row['run_id'] = self.run_id
+        row['script'] = self.script
+        for name in ('success', 'memo_hit'):
+            if name in row:
+                row[name] = int(bool(row[name]))
+        line = json.dumps(dict((name, row.get(name)) for name in COLUMN_NAMES))
+        # sqlite gets the list of symbols as a json string
+        if isinstance(row.get('symbols'), list):
+            row['symbols'] = json.dumps(row['symbols'])
+        values = [row.get(name) for name in COLUMN_NAMES]
+        with self._lock:
+            self._jsonl.write(line + "\n")
+            self._jsonl.flush()
+            self._db.execute(self._insert, values)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._jsonl.close()
+            self._db.close()
@@ -0,0 +1,84 @@
+# This module keeps a journal of the finished units of work of a run, so that an interrupted
+# run can be restarted and picks up where it stopped
+# A unit is identified by the script, the run_name from the [journal] section and the
+# parts given by the script, e.g. folder and file pattern, or minSize/maxSize and iteration.
+# The scripts reading graphml files add the sha256 of their inputs to the unit (see get_files_sha256),
+# so a unit whose inputs have changed since it was finished is done again.
+# Every finished unit is stored with its output file and the sha256 of that file in
+# run_journal.sqlite in the output_dir. Units already in the journal are skipped;
+# with [journal] verify=true only if their output file still exists with the same hash.
+# Use a new run_name to start a run from scratch
+
+import os
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+def get_run_journal(config, script):
+    # returns the journal configured in the [journal] section, or None if it is disabled
+    if not config.has_section('journal') or not config['journal'].getboolean('enabled', fallback=False):
+        return None
+    journal_file = os.path.join(config['data'].get('output_dir'), 'run_journal.sqlite')
+    return RunJournal(journal_file, script, config['journal'].get('run_name', fallback='default'),
+                      verify=config['journal'].getboolean('verify', fallback=False))
+
+def get_file_sha256(path, chunk_size=1024*1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_files_sha256(paths):
+    # one hash over the names and contents of the given files, independent of their order
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update("{}\0{}\0".format(os.path.basename(path), get_file_sha256(path)).encode('utf-8'))
+    return digest.hexdigest()
+
+class RunJournal(object):
+
+    def __init__(self, journal_file, script, run_name, verify=False):
+        self.script = script
+        self.run_name = run_name
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(journal_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS units (unit_key TEXT PRIMARY KEY, script TEXT, run_name TEXT, "
+                         "unit TEXT, output_file TEXT, output_sha256 TEXT, finished_at REAL)")
+        self._db.commit()
+
+    def _unit_key(self, unit):
+        return json.dumps([self.script, self.run_name, sorted(unit.items())])
+
+    def is_done(self, **unit):
+        # True if the unit has been finished before (and its output is unchanged, when verifying)
+        with self._lock:
+            row = self._db.execute("SELECT output_file, output_sha256 FROM units WHERE unit_key = ?", (self._unit_key(unit),)).fetchone()
+        if row is None:
+            return False
+        output_file, output_sha256 = row
+        if self.verify and output_file is not None:
+            if not os.path.exists(output_file) or get_file_sha256(output_file) != output_sha256:
+                logger.info("Output {} of finished unit {} is missing or changed, redoing it".format(output_file, unit))
+                return False
+        return True
+
+    def record(self, output_file=None, **unit):
+        # marks the unit as finished, with the output it has written
+        output_sha256 = get_file_sha256(output_file) if output_file is not None else None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (self._unit_key(unit), self.script, self.run_name, json.dumps(unit), output_file, output_sha256, time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
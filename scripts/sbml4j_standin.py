@@ -0,0 +1,356 @@
+# This is a local stand-in for the SBML4j server, for benchmarking the scripts without a live server
+# It implements the endpoints used by the scripts of this project:
+#   GET  {context}/networks                     - list the networks (lookup by name happens in pysbml4j)
+#   GET  {context}/networks/{uuid}              - download the network as graphml
+#   GET  {context}/networks/{uuid}/options      - the filter and annotation options of the network
+#   POST {context}/networks/{uuid}/context      - create a context network for a list of genes
+#   POST {context}/networks/{uuid}/annotation   - create an annotated copy of the network
+# The base network named [network] base_name is a synthetic random network with [standin] nodes
+# nodes and about [standin] degree relations per node. A context contains the requested genes
+# and all nodes within maxSize steps of them.
+#
+# Latency and errors are injected per request from the [standin] section:
+#   latency=<distribution>, latency_<endpoint>=<distribution> to override it for one endpoint
+#   error_rate=<probability>, error_rate_<endpoint>=<probability>
+# with the endpoints networks, graphml, options, context and annotation, and the distributions
+#   const:<seconds>, uniform:<low>,<high>, normal:<mean>,<sd>,
+#   lognormal:<mu>,<sigma> (of the underlying normal distribution), exponential:<mean>
+#
+# Usage: python sbml4j_standin.py [path to config.ini]
+# Point [server] host/port of the scripts to [standin] host/port to use it
+
+import sys
+import json
+import random
+import threading
+import time
+import uuid
+
+import logging
+import configparser
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger()
+
+ENDPOINTS = ('networks', 'graphml', 'options', 'context', 'annotation')
+
+def parse_distribution(spec):
+    # returns a function drawing a latency in seconds from the given distribution
+    name, _, params = spec.partition(':')
+    name = name.strip()
+    values = [float(p) for p in params.split(',') if p.strip()]
+    if name == 'const':
+        return lambda rng: values[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if name == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if name == 'exponential':
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError("Unknown latency distribution {}".format(spec))
+
+class StandinNetwork(object):
+
+    def __init__(self, name, owner, node_symbols, edges, annotations=None, mapping_type='PPI'):
+        self.uuid = str(uuid.uuid4())
+        self.name = name
+        self.owner = owner
+        self.node_symbols = node_symbols
+        self.node_symbol_set = set(node_symbols)
+        self.edges = edges
+        # annotation name to a map of node symbol to value
+        self.annotations = annotations if annotations is not None else {}
+        self.mapping_type = mapping_type
+
+    def info(self):
+        return {
+            'uuid': self.uuid,
+            'name': self.name,
+            'organismCode': 'hsa',
+            'numberOfNodes': len(self.node_symbols),
+            'numberOfRelations': len(self.edges),
+            'numberOfReactions': 0,
+            'nodeTypes': ['polypeptide'],
+            'relationTypes': ['interacts'],
+            'networkMappingType': self.mapping_type
+        }
+
+    def options(self):
+        return {
+            'filter': {
+                'nodeSymbols': list(self.node_symbols),
+                'nodeTypes': ['polypeptide'],
+                'relationSymbols': ["{}-{}".format(s, t) for s, t in self.edges],
+                'relationTypes': ['interacts']
+            },
+            'annotation': {
+                'nodeAnnotationName': None,
+                'nodeAnnotation': dict.fromkeys(self.node_symbols),
+                'relationAnnotationName': None,
+                'relationAnnotation': None
+            }
+        }
+
+    def graphml_chunks(self):
+        # the graphml document in pieces, so that large networks are never held as one string
+        annotation_names = sorted(self.annotations.keys())
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+        yield '<key id="v_symbol" for="node" attr.name="symbol" attr.type="string"/>\n'
+        for index, annotation_name in enumerate(annotation_names):
+            yield '<key id="v_a{}" for="node" attr.name="{}" attr.type="string"/>\n'.format(index, escape(annotation_name))
+        yield '<graph id="{}" edgedefault="directed">\n'.format(self.uuid)
+        for symbol in self.node_symbols:
+            node = ['<node id="{}"><data key="v_symbol">{}</data>'.format(escape(symbol), escape(symbol))]
+            for index, annotation_name in enumerate(annotation_names):
+                value = self.annotations[annotation_name].get(symbol)
+                if value is not None:
+                    node.append('<data key="v_a{}">{}</data>'.format(index, escape(str(value))))
+            node.append('</node>\n')
+            yield ''.join(node)
+        for source, target in self.edges:
+            yield '<edge source="{}" target="{}"/>\n'.format(escape(source), escape(target))
+        yield '</graph>\n</graphml>\n'
+
+class StandinState(object):
+
+    def __init__(self, standin_conf, base_name):
+        self.lock = threading.Lock()
+        self.rng = random.Random(standin_conf.getint('seed', fallback=1))
+        self.networks = {}
+        self.latencies = {}
+        self.error_rates = {}
+        for endpoint in ENDPOINTS:
+            spec = standin_conf.get('latency_{}'.format(endpoint), fallback=standin_conf.get('latency', fallback='const:0'))
+            self.latencies[endpoint] = parse_distribution(spec)
+            self.error_rates[endpoint] = standin_conf.getfloat('error_rate_{}'.format(endpoint), fallback=standin_conf.getfloat('error_rate', fallback=0.0))
+        self.add_base_network(base_name, standin_conf.getint('nodes', fallback=1000), standin_conf.getint('degree', fallback=3))
+
+    def add_base_network(self, name, number_of_nodes, degree):
+        node_symbols = ["GENE{}".format(i) for i in range(1, number_of_nodes + 1)]
+        edges = []
+        if number_of_nodes > 1:
+            for source in node_symbols:
+                for i in range(degree):
+                    target = node_symbols[self.rng.randrange(number_of_nodes)]
+                    if target != source:
+                        edges.append((source, target))
+        network = StandinNetwork(name, None, node_symbols, edges)
+        self.networks[network.uuid] = network
+        logger.info("Stand-in base network {} with {} nodes and {} relations".format(name, number_of_nodes, len(edges)))
+        return network
+
+    def visible_networks(self, user):
+        with self.lock:
+            return [network for network in self.networks.values() if network.owner is None or network.owner == user]
+
+    def get_network(self, network_uuid, user):
+        with self.lock:
+            network = self.networks.get(network_uuid)
+        if network is None or (network.owner is not None and network.owner != user):
+            return None
+        return network
+
+    def add_network(self, network):
+        with self.lock:
+            self.networks[network.uuid] = network
+        return network
+
+    def draw_latency(self, endpoint):
+        with self.lock:
+            return self.latencies[endpoint](self.rng), self.rng.random() < self.error_rates[endpoint]
+
+def get_derived_name(parent, args, default_prefix):
+    networkname = args.get('networkname', [None])[0]
+    if networkname is None:
+        return "{}_{}".format(default_prefix, parent.name)
+    if args.get('prefixName', ['false'])[0].lower() == 'true':
+        return "{}_{}".format(networkname, parent.name)
+    return networkname
+
+def get_context_nodes(base, genes, max_size):
+    # all nodes within max_size steps of the requested genes
+    # the adjacency is built on first use and kept on the network
+    neighbours = getattr(base, 'neighbours', None)
+    if neighbours is None:
+        neighbours = {}
+        for source, target in base.edges:
+            neighbours.setdefault(source, set()).add(target)
+            neighbours.setdefault(target, set()).add(source)
+        base.neighbours = neighbours
+    context_nodes = set(genes)
+    frontier = set(genes)
+    for step in range(max_size):
+        next_frontier = set()
+        for symbol in frontier:
+            next_frontier.update(neighbours.get(symbol, ()))
+        frontier = next_frontier - context_nodes
+        context_nodes.update(frontier)
+        if not frontier:
+            break
+    return context_nodes
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+    application_context = '/sbml4j'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_reason(self, status, reason):
+        body = reason.encode('utf-8')
+        self.send_response(status)
+        self.send_header('reason', reason)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def route(self):
+        # returns the endpoint name, the network uuid (or None) and the query arguments
+        parsed = urlparse(self.path)
+        path = parsed.path
+        if not path.startswith(self.application_context):
+            return None, None, None
+        parts = [part for part in path[len(self.application_context):].split('/') if part]
+        args = parse_qs(parsed.query)
+        if parts == ['networks']:
+            return 'networks', None, args
+        if len(parts) == 2 and parts[0] == 'networks':
+            return 'graphml', parts[1], args
+        if len(parts) == 3 and parts[0] == 'networks' and parts[2] in ('options', 'context', 'annotation'):
+            return parts[2], parts[1], args
+        return None, None, None
+
+    def handle_request(self, method):
+        endpoint, network_uuid, args = self.route()
+        # always consume the request body, so that the connection can be kept alive
+        body = self.read_json_body() if method == 'POST' else None
+        if endpoint is None or (method == 'GET') != (endpoint in ('networks', 'graphml', 'options')):
+            self.send_error_reason(404, "No endpoint {} {}".format(method, self.path))
+            return
+        latency, fail = self.state.draw_latency(endpoint)
+        if latency > 0:
+            time.sleep(latency)
+        if fail:
+            self.send_error_reason(503, "Injected error for endpoint {}".format(endpoint))
+            return
+        user = self.headers.get('user')
+        if endpoint == 'networks':
+            self.send_json(200, [network.info() for network in self.state.visible_networks(user)])
+            return
+        network = self.state.get_network(network_uuid, user)
+        if network is None:
+            self.send_error_reason(404, "Network with uuid {} not found".format(network_uuid))
+            return
+        if endpoint == 'options':
+            self.send_json(200, network.options())
+        elif endpoint == 'graphml':
+            self.send_graphml(network)
+        elif endpoint == 'context':
+            self.create_context(network, user, args, body)
+        elif endpoint == 'annotation':
+            self.annotate(network, user, args, body)
+
+    def send_graphml(self, network):
+        # sent with chunked transfer encoding, the size is not known up front
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        buffer = []
+        buffered = 0
+        for piece in network.graphml_chunks():
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= 65536:
+                self.write_chunk(''.join(buffer).encode('utf-8'))
+                buffer = []
+                buffered = 0
+        if buffer:
+            self.write_chunk(''.join(buffer).encode('utf-8'))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data):
+        self.wfile.write("{:x}\r\n".format(len(data)).encode('ascii'))
+        self.wfile.write(data)
+        self.wfile.write(b'\r\n')
+
+    def create_context(self, network, user, args, body):
+        genes = body.get('genes', [])
+        unknown_genes = [gene for gene in genes if gene not in network.node_symbol_set]
+        if not genes or unknown_genes:
+            self.send_error_reason(400, "Cannot create context for genes {}".format(unknown_genes if unknown_genes else genes))
+            return
+        max_size = int(args.get('maxSize', ['3'])[0])
+        context_nodes = get_context_nodes(network, genes, max_size)
+        node_symbols = [symbol for symbol in network.node_symbols if symbol in context_nodes]
+        edges = [(source, target) for source, target in network.edges if source in context_nodes and target in context_nodes]
+        context = StandinNetwork(get_derived_name(network, args, 'Context'), user, node_symbols, edges, mapping_type=network.mapping_type)
+        self.send_json(201, self.state.add_network(context).info())
+
+    def annotate(self, network, user, args, body):
+        annotation_name = body.get('nodeAnnotationName')
+        node_annotation = body.get('nodeAnnotation')
+        if not annotation_name or not node_annotation:
+            self.send_error_reason(400, "No node annotation given")
+            return
+        # like SBML4j, the nodes of the copy keep the values they had, the given ones are set or replaced
+        annotations = dict(network.annotations)
+        annotations[annotation_name] = dict(annotations.get(annotation_name, {}), **node_annotation)
+        annotated = StandinNetwork(get_derived_name(network, args, 'Annotated'), user, network.node_symbols, network.edges, annotations, network.mapping_type)
+        self.send_json(201, self.state.add_network(annotated).info())
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+def create_standin_server(config):
+    # returns the configured, not yet started, stand-in server
+    standin_conf = config['standin']
+    StandinHandler.state = StandinState(standin_conf, config['network'].get('base_name'))
+    StandinHandler.application_context = config['server'].get('application_context')
+    server = ThreadingHTTPServer((standin_conf.get('host', fallback='127.0.0.1'), standin_conf.getint('port', fallback=59080)), StandinHandler)
+    server.daemon_threads = True
+    return server
+
+def main(sysArgs):
+    config_file = sysArgs[1] if len(sysArgs) > 1 else "/config/config.ini"
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)-12s: %(levelname)s %(message)s")
+    server = create_standin_server(config)
+    host, port = server.server_address[:2]
+    logger.info("SBML4j stand-in listening on http://{}:{}{}".format(host, port, config['server'].get('application_context')))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+
+    main(sys.argv)
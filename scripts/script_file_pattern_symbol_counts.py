@@ -1,110 +1,161 @@
 import os
 import sys
+import threading
 
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+from concurrent.futures import ThreadPoolExecutor
+
+from client_pool import get_client_pool
 
 import logging
-from logging.config import fileConfig
-import configparser
 
-import xml.etree.ElementTree as ET
+from settings import get_config
+from settings import init_logging
+from settings import abbreviate
+
+from graphml_codec import is_graphml_file
+from graphml_ingest import get_ingest_workers
+from graphml_ingest import create_ingest_executor
+from graphml_ingest import ingest_graphml_files
+from graphml_cache import get_graphml_cache
+from network_session import get_network_session
+from graphml_export import download_graphml
+from graphml_codec import get_output_codec
+from annotations import AnnotationRequest
+from annotations import get_boolean_true_annotation_object
+from annotations import get_annotation_object
+from annotations import annotate_batch
+from run_journal import get_run_journal
+from run_journal import get_files_sha256
+from resilience import get_resilience
+from context_memo import get_context_memo
+from annotation_ledger import get_annotation_ledger
+from input_manifest import is_incremental
+from input_manifest import get_input_manifest
+from input_manifest import get_watch_interval
+from input_manifest import watch
 
-# global definitions for the log-config
-configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
 
-# global definition for the sbml4j-config
-config = configparser.ConfigParser()
-config.read('{}/config.ini'.format(configFolder))
+# global definition for the sbml4j-config, read on first use
+config = get_config()
 
 def init_sbml4j(user=None):
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
 
-    server_conf = config['server']
-    host = server_conf.get('host')
-    if not host.startswith('http'):
-        host = "{}{}".format("http://", host)
-    if user != None:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context'), user=user))
-        return client
-    else:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context')))
-        return client
-
-def get_key_mapping(root):
-    key_mapping = {}
-    for child in root.iter('{http://graphml.graphdrawing.org/xmlns}key'):
-        #print(child.tag, child.attrib)
-        #print(child.attrib['attr.name'])
-        key_mapping[child.attrib['id']] = child.attrib['attr.name']
-    return key_mapping
-
-def get_node_data_elements(node_object, key_mapping, name_to_type_map):
-    node_attribute_map = {}
-    for data in node_object.iter('{http://graphml.graphdrawing.org/xmlns}data'):
-        data_name = key_mapping[data.attrib['key']]
-        if data_name in name_to_type_map:
-            data_type = name_to_type_map[data_name]
-            if data_type == 'double' or data_type == 'float':
-                node_attribute_map[data_name] = float(data.text)
-            else:
-                node_attribute_map[data_name] = data.text
-        else:
-            node_attribute_map[data_name] = data.text
-    return node_attribute_map
-
-def get_id_to_symbol_map(root, key_mapping):
-    id_to_symbol_map = {}
-    for graph in root.iter('{http://graphml.graphdrawing.org/xmlns}graph'):
-        for child in graph.iter('{http://graphml.graphdrawing.org/xmlns}node'):
-            for attr in child.iter('{http://graphml.graphdrawing.org/xmlns}data'):
-                if key_mapping[attr.attrib['key']] == 'symbol':
-                    id_to_symbol_map[child.attrib['id']] = attr.text
+def get_pattern_files(graphml_dir, file_patterns):
+    # returns the graphml files matching at least one pattern, and for each of them the patterns it matches
+    graphml_files = []
+    file_to_patterns_map = {}
+    for file in os.listdir(graphml_dir):
+        if not is_graphml_file(file):
+            logger.info("Skipping non-xml file {}".format(file))
+            continue
+        current_file = os.path.join(graphml_dir, file)
+        matched_patterns = []
+        for file_pattern in file_patterns:
+            if file_pattern not in file:
+                logger.info("Skipping xml-file {} because it does not fit the pattern {}".format(file, file_pattern))
+                continue
+            matched_patterns.append(file_pattern)
+        if matched_patterns:
+            graphml_files.append(current_file)
+            file_to_patterns_map[current_file] = matched_patterns
+    return graphml_files, file_to_patterns_map
 
-    return id_to_symbol_map
+def add_symbol_counts(symbol_count, graphMLSymbols):
+    for symbol in graphMLSymbols:
+        if symbol in symbol_count:
+            symbol_count[symbol] = symbol_count.get(symbol) + 1
+        else:
+            symbol_count[symbol] = 1
 
-def get_boolean_true_annotation_object(name, node_symbols):
-    annotation_object = {}
-    annotation_object['nodeAnnotationName'] = name
-    node_annotation_dict = {}
-    for node_symbol in node_symbols:
-        node_annotation_dict[node_symbol] = True
+def get_parsed_symbol_counts(ingest_executor, graphml_cache, graphml_dir, file_patterns):
+    # test every file against all patterns, so that each file is parsed only once
+    graphml_files, file_to_patterns_map = get_pattern_files(graphml_dir, file_patterns)
+    # parse the matching files in parallel, only the symbols are sent back
+    ingest_results = ingest_graphml_files(ingest_executor, graphml_files, cache=graphml_cache)
+    # build the symbol counts of all patterns in a single pass over the parsed files
+    pattern_symbol_counts = {}
+    pattern_last_symbols = {}
+    for file_pattern in file_patterns:
+        pattern_symbol_counts[file_pattern] = {}
+    for ingest_result in ingest_results:
+        current_file = ingest_result.file
+        logger.info("MARKER0A: Beginning processing of file %s", current_file)
+        for file_pattern in file_to_patterns_map[current_file]:
+            add_symbol_counts(pattern_symbol_counts[file_pattern], ingest_result.symbols)
+            pattern_last_symbols[file_pattern] = ingest_result.symbols
+        logger.info("MARKER0B: Finished processing of file %s", current_file)
+    # end for ingest_result in ingest_results:
+    return pattern_symbol_counts, pattern_last_symbols
 
-    annotation_object['nodeAnnotation'] = node_annotation_dict
+class SymbolCountRun(object):
+    # the clients, caches and stores of a run, shared by all folders
 
-    return annotation_object
+    def __init__(self):
+        # get the graphML files
+        self.graphml_base_dir = config['data'].get('graphml_dir')
+        # get the file patterns to iterate over
+        self.file_patterns = config['data'].get('file_patterns').split(',')
+        # get the output_dir
+        self.output_dir = config['data'].get('output_dir')
+        # the graphml files are parsed by a pool of worker processes
+        self.ingest_executor = create_ingest_executor(get_ingest_workers(config))
+        # results of earlier runs are taken from the parse cache
+        self.graphml_cache = get_graphml_cache(config)
+        # the base network is only looked up once per user
+        self.session = get_network_session(config)
+        # folders and patterns finished by an interrupted run are skipped
+        self.journal = get_run_journal(config, "script_file_pattern_symbol_counts")
+        # transient server errors are retried, a failing server pauses the run
+        self.resilience = get_resilience(config)
+        # a symbol set that has been requested before reuses its context network
+        self.memo = get_context_memo(config)
+        # annotations uploaded before for a network are only sent again if their values have changed
+        self.ledger = get_annotation_ledger(config)
+        # with an index file configured, the counts are taken from the symbol index instead of the graphml files
+        self.index = None
+        # the number of folders (users) processed at the same time
+        self.user_workers = max(1, config.getint('data', 'user_workers', fallback=1))
 
-def get_annotation_object(name, node_symbols, annotation_map):
-    annotation_object = {}
-    annotation_object['nodeAnnotationName'] = name
-    node_annotation_dict = {}
-    for node_symbol in node_symbols:
-        node_annotation_dict[node_symbol] = annotation_map[node_symbol]
+    def refresh_index(self):
+        # loads the index, after reading the graphml files that have changed since it was saved
+        if config.get('index', 'file', fallback='').strip():
+            # imported here, the index needs numpy
+            from symbol_index import get_symbol_index
+            self.index = get_symbol_index(config, self.ingest_executor, self.graphml_cache)
 
-    annotation_object['nodeAnnotation'] = node_annotation_dict
+    def get_symbol_counts(self, folder):
+        graphml_dir = os.path.join(self.graphml_base_dir, folder)
+        if self.index is not None:
+            from symbol_index import get_folder_symbol_counts
+            return get_folder_symbol_counts(self.index, folder, self.file_patterns)
+        return get_parsed_symbol_counts(self.ingest_executor, self.graphml_cache, graphml_dir, self.file_patterns)
 
-    return annotation_object
+    def get_journal_unit(self, folder, file_pattern):
+        # the unit of work of a pattern of a folder, with the hash of its files, so that changed inputs are done again
+        graphml_dir = os.path.join(self.graphml_base_dir, folder)
+        pattern_files = [os.path.join(graphml_dir, file) for file in os.listdir(graphml_dir) if is_graphml_file(file) and file_pattern in file]
+        return {'folder': folder, 'file_pattern': file_pattern, 'input_sha256': get_files_sha256(pattern_files)}
 
-def main(sysArgs):
-    logger.debug("This script reads in the graphml files found in the folder '/graphml'.")
-    logger.debug("It creates a network with the counts of the symbols in all provided graphml files and downloads it to '/output'.")
-    logger.info("MARKER-3A: Beginning creating networks")   
-    # get the graphML files
-    graphml_base_dir = config['data'].get('graphml_dir')
-    graphml_subfolders = os.listdir(graphml_base_dir)
-    # get the file patterns to iterate over
-    file_patterns = config['data'].get('file_patterns').split(',')
-    # get the output_dir
-    output_dir = config['data'].get('output_dir')
-    for folder in graphml_subfolders:
-        logger.info("MARKER-2A: Beginning processing of folder {}".format(folder))
+    def process_folder(self, folder, pending_patterns, journal_units=None):
+        # creates the networks of the given patterns for the files of the folder and returns the graphml file
+        # written for each of them, None for a pattern without symbols
+        resilience = self.resilience
+        if self.journal is not None and journal_units is None:
+            # hashed before the files are read, a change while they are processed makes the next run redo them
+            journal_units = {file_pattern: self.get_journal_unit(folder, file_pattern) for file_pattern in pending_patterns}
         sbml4j_user = folder
-        client = init_sbml4j(user = sbml4j_user)
+        client = resilience.call(init_sbml4j, user = sbml4j_user)
         #client.listNetworks()
-        for file_pattern in file_patterns:
-            logger.info("MARKER-1A: Beginning processing of file_pattern {}".format(file_pattern))
+
+        print ("-------")
+        pattern_symbol_counts, pattern_last_symbols = self.get_symbol_counts(folder)
+        output_files = {}
+
+        for file_pattern in pending_patterns:
+            logger.info("MARKER-1A: Beginning processing of file_pattern %s", file_pattern)
             # get the base network name from config
             base_name = config['network'].get('base_name')
 
@@ -118,70 +169,200 @@ def main(sysArgs):
             for i in range(len(annotation_node_properties)):
                 annotation_name_to_type_map[annotation_node_properties[i]] = annotation_node_types[i]
 
+            symbol_count = pattern_symbol_counts[file_pattern]
+            if not symbol_count:
+                # e.g. all files of the pattern have been removed
+                logger.info("MARKER-1B: No symbols for file_pattern %s, skipping it", file_pattern)
+                output_files[file_pattern] = None
+                continue
             # get the base network
-            net = client.getNetworkByName(base_name)
+            net = resilience.call(self.session.get_network, client, base_name)
             #print(annotation_name_to_type_map)
 
-            symbol_count = {}
-
-            print ("-------")
-            graphml_dir = os.path.join(graphml_base_dir, sbml4j_user)
-            graphml_files = os.listdir(graphml_dir)
-            for file in graphml_files:
-                if not file.endswith('.graphml'):
-                    logger.info("Skipping non-xml file {}".format(file))
-                    continue
-                if file_pattern not in file:
-                    logger.info("Skipping xml-file {} because it does not fit the pattern {}".format(file, file_pattern))
-                    continue
-                #annotation_name_prefix = file.split('.')[0]
-                current_file = os.path.join(graphml_dir, file)
-                logger.info("MARKER0A: Beginning processing of file {}".format(current_file))
-                tree = ET.parse(current_file)
-                root = tree.getroot()
-                key_mapping = get_key_mapping(root)
-                #print("-----")
-                #print(key_mapping)
-                id_to_symbol_map = get_id_to_symbol_map(root, key_mapping)
-
-                graphMLSymbols = list(id_to_symbol_map.values())
-                # create the context network
-                for symbol in graphMLSymbols:
-                    if symbol in symbol_count:
-                        symbol_count[symbol] = symbol_count.get(symbol) + 1
-                    else:
-                        symbol_count[symbol] = 1
-                logger.info("MARKER0B: Finished processing of file {}".format(current_file))
-            # end for file in graphml_files:
-
-            logger.info("MARKER1A: Starting context creation with symbols {}".format(list(symbol_count.keys())))
+            # the type annotation uses the symbols of the last file that matched the pattern
+            graphMLSymbols = pattern_last_symbols.get(file_pattern, [])
+
+            # only the first symbols are logged, the list can have thousands of them
+            logger.info("MARKER1A: Starting context creation with symbols %s", abbreviate(symbol_count))
             # create context
-            net.createContext(list(symbol_count.keys()), networkname="context_{}_{}_{}".format(client.user, file_pattern, net.networkMappingType), minSize=0, maxSize=0)
+            context_name = "context_{}_{}_{}".format(client.user, file_pattern, net.networkMappingType)
+            if self.memo is not None:
+                self.memo.create_context(net, list(symbol_count.keys()), 0, 0, networkname=context_name, resilience=resilience)
+            else:
+                resilience.call(net.createContext, list(symbol_count.keys()), networkname=context_name, minSize=0, maxSize=0)
             logger.info("MARKER1B: Finished context creation")
             # Create an annotation object for adding the DeRegNet_Node boolean property
             type_annotation_object = get_boolean_true_annotation_object("DeRegNet_Node", node_symbols=graphMLSymbols)
             #print(type_annotation_object)
-            logger.info("MARKER2A: Adding boolean annotation for DeRegNet_Node")
-            net.annotate(annotationDict=type_annotation_object, networkname = "DRN", doPrefixName=True)
-            logger.info("MARKER2B: Finished adding boolean annotation")
             # create an annotation object for adding the number of times a node was present in a graphml
             node_annotation_object = get_annotation_object("DeRegNet_Count", symbol_count.keys(), symbol_count)
-            logger.info("MARKER3A: Adding DeRegNet_Count annotation")
-            net.annotate(annotationDict=node_annotation_object, networkname = file_pattern, doPrefixName=True)
-            logger.info("MARKER3B: Finished adding DeRegNet_Count annotation")
+            annotate_batch(net, [AnnotationRequest(type_annotation_object, "DRN", True,
+                                                   "MARKER2A: Adding boolean annotation for DeRegNet_Node",
+                                                   "MARKER2B: Finished adding boolean annotation"),
+                                 AnnotationRequest(node_annotation_object, file_pattern, True,
+                                                   "MARKER3A: Adding DeRegNet_Count annotation",
+                                                   "MARKER3B: Finished adding DeRegNet_Count annotation")],
+                           resilience=resilience, ledger=self.ledger)
             filename="{}.graphml".format(net.name)
-            output_file=os.path.join(output_dir, filename)
-            logger.info("MARKER4A: Writing graphml file {}".format(output_file))
-            with open(output_file, 'w') as f:
-                f.write(net.graphML())
-                logger.info("MARKER4B: Finished writing graphml file {}".format(output_file))
-            logger.info("MARKER-1B: Finished processing of file_pattern {}".format(file_pattern))
+            output_file=os.path.join(self.output_dir, filename)
+            logger.info("MARKER4A: Writing graphml file %s", output_file)
+            output_file = resilience.call(download_graphml, net, output_file, codec=get_output_codec(config))
+            logger.info("MARKER4B: Finished writing graphml file %s", output_file)
+            if self.journal is not None:
+                self.journal.record(output_file=output_file, **journal_units[file_pattern])
+            output_files[file_pattern] = output_file
+            logger.info("MARKER-1B: Finished processing of file_pattern %s", file_pattern)
             # end for file_pattern
-    
+        return output_files
+
+    def start_pass(self):
+        # called before every pass over the inputs
+        if self.memo is not None:
+            self.memo.start_pass()
+        if self.ledger is not None:
+            self.ledger.start_pass()
+
+    def close(self):
+        if self.ingest_executor is not None:
+            self.ingest_executor.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        if self.memo is not None:
+            self.memo.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+def run_folders(folders, process_folder, workers):
+    # calls process_folder for every folder, with up to workers folders at the same time
+    # a folder is processed by one thread from start to end, so the patterns of a user keep their order
+    if workers <= 1 or len(folders) <= 1:
+        for folder in folders:
+            process_folder(folder)
+        return
+
+    def process_named_folder(folder):
+        # the thread is named after the folder while it processes it, the log lines of the folder carry its name
+        thread = threading.current_thread()
+        thread_name = thread.name
+        thread.name = folder
+        try:
+            process_folder(folder)
+        finally:
+            thread.name = thread_name
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="user") as executor:
+        futures = [executor.submit(process_named_folder, folder) for folder in folders]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # like the sequential run, the folders not started yet are given up after a failure
+            for future in futures:
+                future.cancel()
+            raise
+
+def run_all_folders(run):
+    run.start_pass()
+    run.refresh_index()
+    folder_patterns = {}
+    folder_journal_units = {}
+    for folder in os.listdir(run.graphml_base_dir):
+        pending_patterns = run.file_patterns
+        if run.journal is not None:
+            journal_units = {file_pattern: run.get_journal_unit(folder, file_pattern) for file_pattern in run.file_patterns}
+            pending_patterns = [file_pattern for file_pattern in run.file_patterns if not run.journal.is_done(**journal_units[file_pattern])]
+            if not pending_patterns:
+                logger.info("MARKER-2B: Folder {} has been finished before, skipping it".format(folder))
+                continue
+            folder_journal_units[folder] = journal_units
+        folder_patterns[folder] = pending_patterns
+
+    def process_folder(folder):
+        logger.info("MARKER-2A: Beginning processing of folder {}".format(folder))
+        run.process_folder(folder, folder_patterns[folder], folder_journal_units.get(folder))
         logger.info("MARKER-2B: Finished processing of folder {}".format(folder))
-        # end for folder, aka user
 
-    logger.info("MARKER-3B: Done creating networks")   
+    run_folders(list(folder_patterns.keys()), process_folder, run.user_workers)
+
+def list_input_files(graphml_base_dir):
+    # the path of every graphml file in the folders, by folder/file
+    files = {}
+    for folder in os.listdir(graphml_base_dir):
+        folder_dir = os.path.join(graphml_base_dir, folder)
+        if not os.path.isdir(folder_dir):
+            continue
+        for file in os.listdir(folder_dir):
+            if is_graphml_file(file):
+                files["{}/{}".format(folder, file)] = os.path.join(folder_dir, file)
+    return files
+
+def run_changed_folders(run, manifest):
+    # recreates only the networks of the patterns of the files added, changed or removed since the last pass
+    files = list_input_files(run.graphml_base_dir)
+    changes = manifest.get_changes(files)
+    changed_files = changes.added + changes.changed + changes.removed
+    if not changed_files:
+        return
+    logger.info("MARKER-4A: {} added, {} changed and {} removed graphml files".format(len(changes.added), len(changes.changed), len(changes.removed)))
+    run.start_pass()
+    run.refresh_index()
+    folder_files = {}
+    for file_key in changed_files:
+        folder, file = file_key.split('/', 1)
+        folder_files.setdefault(folder, []).append(file_key)
+
+    def process_folder(folder):
+        affected_patterns = [file_pattern for file_pattern in run.file_patterns
+                             if any(file_pattern in file_key.split('/', 1)[1] for file_key in folder_files[folder])]
+        if affected_patterns and os.path.isdir(os.path.join(run.graphml_base_dir, folder)):
+            logger.info("MARKER-2A: Beginning processing of folder {}, file_patterns {}".format(folder, affected_patterns))
+            output_files = run.process_folder(folder, affected_patterns)
+            logger.info("MARKER-2B: Finished processing of folder {}".format(folder))
+        else:
+            # the folder has been removed
+            output_files = {file_pattern: None for file_pattern in affected_patterns}
+        for file_pattern, output_file in output_files.items():
+            # the graphml file of a pattern without files left is removed, like a renamed one
+            unit_key = "{}/{}".format(folder, file_pattern)
+            for previous_output_file in manifest.get_unit_output_files(unit_key):
+                if previous_output_file != output_file and os.path.exists(previous_output_file):
+                    logger.info("Removing {}, it is no longer the output of file_pattern {} of folder {}".format(previous_output_file, file_pattern, folder))
+                    os.remove(previous_output_file)
+            if output_file is not None:
+                manifest.record_unit(unit_key, [output_file])
+            else:
+                manifest.remove_unit(unit_key)
+        # the folder is done, its files count as processed
+        for file_key in folder_files[folder]:
+            if file_key in changes.states:
+                manifest.record(file_key, files[file_key], changes.states[file_key])
+            else:
+                manifest.remove(file_key)
+
+    run_folders(sorted(folder_files.keys()), process_folder, run.user_workers)
+    logger.info("MARKER-4B: Done updating networks")
+
+def main(sysArgs):
+    init_logging()
+    logger.debug("This script reads in the graphml files found in the folder '/graphml'.")
+    logger.debug("It creates a network with the counts of the symbols in all provided graphml files and downloads it to '/output'.")
+    logger.debug("With --incremental only the patterns of added, changed or removed files are processed, --watch keeps doing so.")
+    run = SymbolCountRun()
+    try:
+        if is_incremental(config, sysArgs):
+            manifest = get_input_manifest(config, "script_file_pattern_symbol_counts")
+            if '--watch' in sysArgs:
+                watch(lambda: run_changed_folders(run, manifest), get_watch_interval(config))
+            else:
+                run_changed_folders(run, manifest)
+            manifest.close()
+        else:
+            logger.info("MARKER-3A: Beginning creating networks")
+            run_all_folders(run)
+            logger.info("MARKER-3B: Done creating networks")
+    finally:
+        run.close()
+
 if __name__ == "__main__":
 
     main(sys.argv)
@@ -1,165 +1,210 @@
 import os
 import sys
 
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+from client_pool import get_client_pool
 
 import logging
-from logging.config import fileConfig
-import configparser
 
-import xml.etree.ElementTree as ET
+from settings import get_config
+from settings import init_logging
+
+from graphml_reader import read_graphml
+from graphml_cache import get_graphml_cache
+from network_session import get_network_session
+from graphml_export import download_graphml
+from graphml_codec import get_output_codec
+from annotations import AnnotationRequest
+from annotations import get_boolean_true_annotation_object
+from annotations import get_symbol_annotation_maps
+from annotations import get_property_annotation_objects
+from annotations import annotate_batch
+from run_journal import get_run_journal
+from run_journal import get_file_sha256
+from resilience import get_resilience
+from context_memo import get_context_memo
+from annotation_ledger import get_annotation_ledger
+from input_manifest import is_incremental
+from input_manifest import get_input_manifest
+from input_manifest import get_watch_interval
+from input_manifest import watch
 
-# global definitions for the log-config
-configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
 
-# global definition for the sbml4j-config
-config = configparser.ConfigParser()
-config.read('{}/config.ini'.format(configFolder))
+# global definition for the sbml4j-config, read on first use
+config = get_config()
 
 def init_sbml4j(user=None):
-
-    server_conf = config['server']
-    host = server_conf.get('host')
-    if not host.startswith('http'):
-        host = "{}{}".format("http://", host)
-    if user != None:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context'), user=user))
-        return client
-    else:
-        client = Sbml4j(Configuration(host, server_conf.get('port'), server_conf.get('application_context')))
-        return client
-
-def get_key_mapping(root):
-    key_mapping = {}
-    for child in root.iter('{http://graphml.graphdrawing.org/xmlns}key'):
-        #print(child.tag, child.attrib)
-        #print(child.attrib['attr.name'])
-        key_mapping[child.attrib['id']] = child.attrib['attr.name']
-    return key_mapping
-
-def get_node_data_elements(node_object, key_mapping, name_to_type_map):
-    node_attribute_map = {}
-    for data in node_object.iter('{http://graphml.graphdrawing.org/xmlns}data'):
-        data_name = key_mapping[data.attrib['key']]
-        if data_name in name_to_type_map:
-            data_type = name_to_type_map[data_name]
-            if data_type == 'double' or data_type == 'float':
-                node_attribute_map[data_name] = float(data.text)
-            else:
-                node_attribute_map[data_name] = data.text
+    # all clients share the keep-alive connections of the pool for the configured server
+    return get_client_pool(config).get_client(user)
+
+class OneNetworkRun(object):
+    # the clients, caches and settings of a run, shared by all files
+
+    def __init__(self):
+        # transient server errors are retried, a failing server pauses the run
+        self.resilience = get_resilience(config)
+        self.client = self.resilience.call(init_sbml4j, user = config['server'].get('user'))
+        # a symbol set that has been requested before reuses its context network
+        self.memo = get_context_memo(config)
+        # annotations uploaded before for a network are only sent again if their values have changed
+        self.ledger = get_annotation_ledger(config)
+        # the base network is only looked up once per session
+        self.session = get_network_session(config)
+        #client.listNetworks()
+
+        # get the base network name from config
+        self.base_name = config['network'].get('base_name')
+        # get the graphML files
+        self.graphml_dir = config['data'].get('graphml_dir')
+        # get the output_dir
+        self.output_dir = config['data'].get('output_dir')
+        # the config option to get the annotation Information
+        annotation_config = config['annotation']
+        self.annotation_type = annotation_config.get('type_name')
+        self.annotation_node_properties = annotation_config.get('node_properties').split(',')
+        annotation_node_types = annotation_config.get('node_property_types').split(',')
+
+        self.annotation_name_to_type_map = {}
+        for i in range(len(self.annotation_node_properties)):
+            self.annotation_name_to_type_map[self.annotation_node_properties[i]] = annotation_node_types[i]
+        #print(annotation_name_to_type_map)
+        # results of earlier runs are taken from the parse cache
+        self.graphml_cache = get_graphml_cache(config)
+        # files finished by an interrupted run are skipped
+        self.journal = get_run_journal(config, "script_one_network_for_each_graphml")
+
+    def get_journal_unit(self, file):
+        # the unit of work of an input file, with the hash of its content, so that a changed file is done again
+        return {'file': file, 'input_sha256': get_file_sha256(os.path.join(self.graphml_dir, file))}
+
+    def process_file(self, file, journal_unit=None):
+        # creates the network of one graphml file and returns the graphml file written for it
+        resilience = self.resilience
+        if self.journal is not None and journal_unit is None:
+            # hashed before the file is read, a change while it is processed makes the next run redo it
+            journal_unit = self.get_journal_unit(file)
+        annotation_name_prefix = file.split('.')[0]
+        current_file = os.path.join(self.graphml_dir, file)
+        logger.debug("Processing File %s", current_file)
+        # read the key mapping, the symbols and the node attributes in one pass
+        if self.graphml_cache is not None:
+            graphml_content = self.graphml_cache.read(current_file, self.annotation_name_to_type_map)
         else:
-            node_attribute_map[data_name] = data.text
-    return node_attribute_map
-
-def get_id_to_symbol_map(root, key_mapping):
-    id_to_symbol_map = {}
-    for graph in root.iter('{http://graphml.graphdrawing.org/xmlns}graph'):
-        for child in graph.iter('{http://graphml.graphdrawing.org/xmlns}node'):
-            for attr in child.iter('{http://graphml.graphdrawing.org/xmlns}data'):
-                if key_mapping[attr.attrib['key']] == 'symbol':
-                    id_to_symbol_map[child.attrib['id']] = attr.text
-
-    return id_to_symbol_map
-
-def get_boolean_true_annotation_object(name, node_symbols):
-    annotation_object = {}
-    annotation_object['nodeAnnotationName'] = name
-    node_annotation_dict = {}
-    for node_symbol in node_symbols:
-        node_annotation_dict[node_symbol] = True
-
-    annotation_object['nodeAnnotation'] = node_annotation_dict
-
-    return annotation_object
-
-def get_annotation_object(name, node_symbols, annotation_map):
-    annotation_object = {}
-    annotation_object['nodeAnnotationName'] = name
-    node_annotation_dict = {}
-    for node_symbol in node_symbols:
-        node_annotation_dict[node_symbol] = annotation_map[node_symbol]
-
-    annotation_object['nodeAnnotation'] = node_annotation_dict
-
-    return annotation_object
+            graphml_content = read_graphml(current_file, self.annotation_name_to_type_map)
+        id_to_symbol_map = graphml_content.id_to_symbol_map
+
+        # get the base network
+        net = resilience.call(self.session.get_network, self.client, self.base_name)
+        graphMLSymbols = list(id_to_symbol_map.values())
+        # create the context network
+        context_name = "{}_{}".format(annotation_name_prefix, net.networkMappingType)
+        if self.memo is not None:
+            self.memo.create_context(net, graphMLSymbols, 0, 0, networkname=context_name, resilience=resilience)
+        else:
+            resilience.call(net.createContext, graphMLSymbols, networkname=context_name, minSize=0, maxSize=0)
+
+        # build the deregnetNode annotation and the annotations of all configured properties
+        type_annotation_object = get_boolean_true_annotation_object("{}_{}".format(annotation_name_prefix, self.annotation_type), node_symbols=graphMLSymbols)
+        print(type_annotation_object)
+        # the attributes of all nodes have been gathered while reading the file,
+        # the maps of symbol to value of all properties are filled in one pass over them
+        symbol_annotation_maps = get_symbol_annotation_maps(graphml_content.node_attributes, self.annotation_node_properties)
+        property_annotation_objects = get_property_annotation_objects(annotation_name_prefix, graphMLSymbols, symbol_annotation_maps)
+
+        # and submit them together
+        annotation_requests = [AnnotationRequest(type_annotation_object, self.annotation_type, True)]
+        for node_annotation in self.annotation_node_properties:
+            annotation_requests.append(AnnotationRequest(property_annotation_objects[node_annotation], node_annotation, True))
+        annotate_batch(net, annotation_requests, resilience=resilience, ledger=self.ledger)
+
+        filename="{}.graphml".format(net.name)
+        output_file=os.path.join(self.output_dir, filename)
+
+        output_file = resilience.call(download_graphml, net, output_file, codec=get_output_codec(config))
+        if self.journal is not None:
+            self.journal.record(output_file=output_file, **journal_unit)
+        return output_file
+
+    def start_pass(self):
+        # called before every pass over the inputs
+        if self.memo is not None:
+            self.memo.start_pass()
+        if self.ledger is not None:
+            self.ledger.start_pass()
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        if self.memo is not None:
+            self.memo.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+def run_all_files(run):
+    print ("-------")
+    run.start_pass()
+    graphml_files = os.listdir(run.graphml_dir)
+    for file in graphml_files:
+        journal_unit = None
+        if run.journal is not None and os.path.isfile(os.path.join(run.graphml_dir, file)):
+            journal_unit = run.get_journal_unit(file)
+            if run.journal.is_done(**journal_unit):
+                logger.info("Skipping input %s, it has been finished before", file)
+                continue
+        try:
+            run.process_file(file, journal_unit)
+        except Exception as e:
+            logger.warning("Unable to create a network and/or graphml for input {}: {}".format(file, e))
+
+def run_changed_files(run, manifest):
+    # creates the networks of the files added or changed since the last pass, and removes the graphml files
+    # written for removed files (their networks stay on the server)
+    files = {}
+    for file in os.listdir(run.graphml_dir):
+        if os.path.isfile(os.path.join(run.graphml_dir, file)):
+            files[file] = os.path.join(run.graphml_dir, file)
+    changes = manifest.get_changes(files)
+    if not (changes.added or changes.changed or changes.removed):
+        return
+    logger.info("{} added, {} changed and {} removed graphml files".format(len(changes.added), len(changes.changed), len(changes.removed)))
+    run.start_pass()
+    for file in changes.added + changes.changed:
+        try:
+            output_file = run.process_file(file)
+        except Exception as e:
+            # not recorded, it is tried again in the next pass
+            logger.warning("Unable to create a network and/or graphml for input {}: {}".format(file, e))
+            continue
+        manifest.record(file, files[file], changes.states[file], [output_file])
+    for file in changes.removed:
+        # an output also written for another input (e.g. the same network name) is kept
+        shared_output_files = manifest.get_shared_output_files(file)
+        for output_file in manifest.get_output_files(file):
+            if output_file in shared_output_files:
+                logger.info("Keeping {}, it is also the output of another input".format(output_file))
+            elif os.path.exists(output_file):
+                logger.info("Removing {}, its input {} has been removed".format(output_file, file))
+                os.remove(output_file)
+        manifest.remove(file)
 
 def main(sysArgs):
+    init_logging()
     logger.debug("This script reads in the graphml files found in the folder '/graphml'.")
     logger.debug("It creates a network for each of the graphml files found and downloads it to '/output'.")
-
-    client = init_sbml4j(user = config['server'].get('user'))
-    #client.listNetworks()
-
-    # get the base network name from config
-    base_name = config['network'].get('base_name')
-    # get the graphML files
-    graphml_dir = config['data'].get('graphml_dir')
-    # get the output_dir
-    output_dir = config['data'].get('output_dir')
-    # the config option to get the annotation Information
-    annotation_config = config['annotation']
-    annotation_type = annotation_config.get('type_name')
-    annotation_node_properties = annotation_config.get('node_properties').split(',')
-    annotation_node_types = annotation_config.get('node_property_types').split(',')
-
-    annotation_name_to_type_map = {}
-    for i in range(len(annotation_node_properties)):
-        annotation_name_to_type_map[annotation_node_properties[i]] = annotation_node_types[i]
-    #print(annotation_name_to_type_map)
-    print ("-------")
-    graphml_files = os.listdir(graphml_dir)
-    for file in graphml_files:
-        try:
-            annotation_name_prefix = file.split('.')[0]
-            current_file = os.path.join(graphml_dir, file)
-            logger.debug("Processing File {}".format(current_file))
-            tree = ET.parse(current_file)
-            root = tree.getroot()
-            key_mapping = get_key_mapping(root)
-            #print("-----")
-            #print(key_mapping)
-            id_to_symbol_map = get_id_to_symbol_map(root, key_mapping)
-
-            # get the base network
-            net = client.getNetworkByName(base_name)
-            graphMLSymbols = list(id_to_symbol_map.values())
-            # create the context network
-            net.createContext(graphMLSymbols, networkname="{}_{}".format(annotation_name_prefix, net.networkMappingType), minSize=0, maxSize=0)
-
-            # add the deregnetNode annotation
-            type_annotation_object = get_boolean_true_annotation_object("{}_{}".format(annotation_name_prefix, annotation_type), node_symbols=graphMLSymbols)
-            print(type_annotation_object)
-            net.annotate(annotationDict=type_annotation_object, networkname = annotation_type, doPrefixName=True)
-
-            # iterate over the nodes, gahter all attributes
-            node_id_to_annotation_map = {}
-            for graph in root.iter('{http://graphml.graphdrawing.org/xmlns}graph'):
-                for child in graph.iter('{http://graphml.graphdrawing.org/xmlns}node'):
-                    node_id_to_annotation_map[child.attrib['id']] = get_node_data_elements(child, key_mapping, annotation_name_to_type_map)
-            #print(node_id_to_annotation_map)
-
-            # for each of the desired/configured annotations, create an annotation object
-            for node_annotation in annotation_node_properties:
-
-                # need a map, linking the node symbol to the actual annotation element for this node_annotation
-                symbol_to_annotation_map = {}
-                for node_id, node_annotation_map in node_id_to_annotation_map.items():
-                    symbol_to_annotation_map[node_annotation_map['symbol']] = node_annotation_map[node_annotation]
-                #print(symbol_to_annotation_map)
-                node_annotation_object = get_annotation_object("{}_{}".format(annotation_name_prefix, node_annotation), node_symbols=graphMLSymbols, annotation_map=symbol_to_annotation_map)
-                net.annotate(annotationDict=node_annotation_object, networkname = node_annotation, doPrefixName=True)
-
-            filename="{}.graphml".format(net.name)
-            output_file=os.path.join(output_dir, filename)
-
-            with open(output_file, 'w') as f:
-                f.write(net.graphML())
-        except:
-            logger.warning("Unable to create a network and/or graphml for input {}".format(file))
+    logger.debug("With --incremental only added, changed or removed files are processed, --watch keeps doing so.")
+    run = OneNetworkRun()
+    try:
+        if is_incremental(config, sysArgs):
+            manifest = get_input_manifest(config, "script_one_network_for_each_graphml")
+            if '--watch' in sysArgs:
+                watch(lambda: run_changed_files(run, manifest), get_watch_interval(config))
+            else:
+                run_changed_files(run, manifest)
+            manifest.close()
+        else:
+            run_all_files(run)
+    finally:
+        run.close()
 
 
 if __name__ == "__main__":
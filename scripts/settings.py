@@ -0,0 +1,138 @@
+# This module loads the config and the log config of the scripts when they are first needed
+# The scripts used to configure logging and read /config/config.ini as soon as they were imported.
+# Now config is a LazyConfig that reads the file on its first use, and init_logging configures
+# logging once, when main starts, so importing a script (by the runner of script.py or by
+# startup_benchmark.py) does not touch /config at all.
+#
+# Logging is configured in the [logging] section:
+#   queue - the handlers of the root logger write from a thread of their own; the logging threads only put
+#           the records on a queue, the messages are formatted by that thread when the record is written
+#   max_items - the number of items of a list shown by abbreviate, the rest is only counted
+# As the records are formatted later, the arguments of a log call must not be changed after it
+
+import os
+import atexit
+import itertools
+import threading
+import configparser
+
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+# global definitions for the log-config
+configFolder = "/config"
+
+_logging_lock = threading.Lock()
+_logging_initialized = False
+_config = None
+
+def get_config_file():
+    return '{}/config.ini'.format(configFolder)
+
+def init_logging():
+    # configures logging from the config file, only the first call does anything
+    global _logging_initialized
+    with _logging_lock:
+        if _logging_initialized:
+            return
+        import logging
+        from logging.config import fileConfig
+        # keep the loggers of the shared modules, they are created on import before this
+        fileConfig(get_config_file(), disable_existing_loggers=False)
+        logging.getLogger("chardet.charsetprober").disabled = True
+        if get_config().getboolean('logging', 'queue', fallback=True):
+            start_log_queue(logging.getLogger())
+        _logging_initialized = True
+
+def start_log_queue(logger):
+    # moves the handlers of the logger behind a queue, they are run by a listener thread
+    import queue
+    handlers = list(logger.handlers)
+    if not handlers:
+        return None
+    log_queue = queue.Queue(-1)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(DeferredQueueHandler(log_queue, handlers))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # write the records still in the queue at the end of the run
+    atexit.register(listener.stop)
+    return listener
+
+class DeferredQueueHandler(QueueHandler):
+    # puts the records on the queue as they are, they are formatted by the handlers of the listener
+
+    def __init__(self, log_queue, handlers):
+        super(DeferredQueueHandler, self).__init__(log_queue)
+        self._pid = os.getpid()
+        self._handlers = handlers
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if os.getpid() != self._pid:
+            # a forked worker process has no listener thread, it writes its records itself
+            for handler in self._handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            return
+        super(DeferredQueueHandler, self).emit(record)
+
+class Abbreviated(object):
+    # the first items of a collection and how many there are, formatted when the log record is written
+
+    def __init__(self, items, limit):
+        self.count = len(items)
+        self.items = list(itertools.islice(items, limit))
+
+    def __str__(self):
+        if self.count <= len(self.items):
+            return str(self.items)
+        return "{}, ...] ({} of {})".format(str(self.items)[:-1], len(self.items), self.count)
+
+    __repr__ = __str__
+
+def abbreviate(items, limit=None):
+    # for log arguments: only the first max_items items of a possibly huge list, set or dict (its keys)
+    if limit is None:
+        limit = get_config().getint('logging', 'max_items', fallback=20)
+    return Abbreviated(items, limit)
+
+class LazyConfig(object):
+    # a ConfigParser that is read on first use, it behaves like the ConfigParser otherwise
+
+    def __init__(self, config_file=None):
+        self._config_file = config_file
+        self._parser = None
+        self._lock = threading.Lock()
+
+    def _get_parser(self):
+        if self._parser is None:
+            with self._lock:
+                if self._parser is None:
+                    parser = configparser.ConfigParser()
+                    parser.read(self._config_file or get_config_file())
+                    self._parser = parser
+        return self._parser
+
+    def __getattr__(self, name):
+        # only called for the attributes of the ConfigParser, e.g. get, getint, has_section, set
+        return getattr(self._get_parser(), name)
+
+    def __getitem__(self, section):
+        return self._get_parser()[section]
+
+    def __contains__(self, section):
+        return section in self._get_parser()
+
+    def __iter__(self):
+        return iter(self._get_parser())
+
+def get_config():
+    # the config of the scripts, shared by all scripts of a process
+    global _config
+    if _config is None:
+        _config = LazyConfig()
+    return _config
@@ -0,0 +1,135 @@
+# This script measures the cold start of the scripts, the time until a fresh python process has imported them
+# Every start of the container runs a new interpreter that imports the entry point and everything it needs
+# before the first request is sent. For the entry point and every configured script this script starts
+# a new process that only imports it:
+#   - repeats times to measure the wall time of the process (median and minimum)
+#   - once with python -X importtime for the import time of the script and the modules that take longest
+# The time of an interpreter that imports nothing is measured as well, as the baseline.
+# The results are logged and appended as one line of JSON to the history file in the output_dir,
+# and compared with the previous line of the history, so a change that slows down startup shows up.
+# Configured in the [startup] section:
+#   entry - the entry point of the container
+#   scripts - the scripts in this folder to measure, comma separated, without .py
+#   repeats, top - the number of timed starts and of the slowest modules to report
+#   history - the history file, relative to the output_dir
+#   regression - the relative slowdown against the previous run that is logged as a warning
+# Scripts given as arguments are measured instead of the configured ones:
+#   python startup_benchmark.py getNetwork benchmark_main
+
+import os
+import sys
+import time
+import json
+import subprocess
+
+import logging
+
+from settings import get_config
+from settings import init_logging
+
+logger = logging.getLogger()
+
+# global definition for the sbml4j-config, read on first use
+config = get_config()
+
+def time_start(arguments, cwd, repeats):
+    # the wall times of repeats processes started with the arguments
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start_time)
+    return sorted(times)
+
+def parse_importtime(output, module):
+    # the cumulative import time of module and the self times of the modules it imported, in seconds
+    # the lines of -X importtime are "import time: self [us] | cumulative | name", indented by depth,
+    # every module comes after the modules it imported
+    imported = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module and not name[1:].startswith(' '):
+            return int(cumulative) / 1e6, [(imported_name, imported_time / 1e6) for imported_name, imported_time in imported]
+        if not name[1:].startswith(' '):
+            # a top level import of the interpreter, before the module
+            imported = []
+            continue
+        imported.append((name.strip(), int(self_time)))
+    raise Exception("No import time for {} in the output".format(module))
+
+def measure_script(script_file, repeats, top):
+    folder, filename = os.path.split(os.path.abspath(script_file))
+    module = os.path.splitext(filename)[0]
+    import_command = "import {}".format(module)
+    times = time_start(['-c', import_command], folder, repeats)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', import_command], cwd=folder,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True).stderr.decode('utf-8')
+    import_time, imported = parse_importtime(output, module)
+    slowest = sorted(imported, key=lambda entry: entry[1], reverse=True)[:top]
+    return {'name': module, 'file': os.path.abspath(script_file), 'median': times[len(times) // 2], 'min': times[0],
+            'import': import_time, 'slowest': [[name, self_time] for name, self_time in slowest]}
+
+def read_last_entry(history_file):
+    if not os.path.exists(history_file):
+        return None
+    last_line = None
+    with open(history_file) as f:
+        for line in f:
+            if line.strip():
+                last_line = line
+    return json.loads(last_line) if last_line is not None else None
+
+def compare_with_previous(entry, previous, regression):
+    previous_results = {}
+    if previous is not None:
+        previous_results = {result['name']: result for result in previous['scripts']}
+    for result in entry['scripts']:
+        message = "{}: median {:0.4f} s, min {:0.4f} s, imports {:0.4f} s".format(result['name'], result['median'], result['min'], result['import'])
+        last = previous_results.get(result['name'])
+        if last is None or last['median'] <= 0:
+            logger.info(message)
+            continue
+        change = (result['median'] - last['median']) / last['median']
+        message = "{} (previous {:0.4f} s, {:+0.1%})".format(message, last['median'], change)
+        if change > regression:
+            logger.warning("{}, slower than the previous run".format(message))
+        else:
+            logger.info(message)
+        for name, self_time in result['slowest']:
+            logger.debug("  {}: {:0.4f} s".format(name, self_time))
+
+def main(sysArgs):
+    init_logging()
+    logger.debug("This script measures the time a new python process needs to import the entry point and the scripts")
+    entry = config.get('startup', 'entry', fallback='/code/script.py')
+    repeats = config.getint('startup', 'repeats', fallback=5)
+    top = config.getint('startup', 'top', fallback=10)
+    regression = config.getfloat('startup', 'regression', fallback=0.2)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if len(sysArgs) > 1:
+        scripts = sysArgs[1:]
+    else:
+        scripts = [script.strip() for script in config.get('startup', 'scripts', fallback='getNetwork').split(',') if script.strip()]
+    script_files = [entry] + [os.path.join(script_dir, "{}.py".format(os.path.splitext(script)[0])) for script in scripts]
+
+    interpreter = time_start(['-c', 'pass'], script_dir, repeats)
+    entry_record = {'timestamp': time.time(), 'python': sys.version.split()[0], 'repeats': repeats,
+                    'interpreter': {'median': interpreter[len(interpreter) // 2], 'min': interpreter[0]}, 'scripts': []}
+    logger.info("Interpreter without imports: median {:0.4f} s, min {:0.4f} s".format(entry_record['interpreter']['median'], entry_record['interpreter']['min']))
+    for script_file in script_files:
+        if not os.path.exists(script_file):
+            logger.info("Skipping {}, it does not exist".format(script_file))
+            continue
+        entry_record['scripts'].append(measure_script(script_file, repeats, top))
+
+    history_file = os.path.join(config['data'].get('output_dir'), config.get('startup', 'history', fallback='startup_history.jsonl'))
+    compare_with_previous(entry_record, read_last_entry(history_file), regression)
+    with open(history_file, 'a') as f:
+        f.write(json.dumps(entry_record) + "\n")
+    logger.info("Appended the startup times to {}".format(history_file))
+
+if __name__ == "__main__":
+
+    main(sys.argv)
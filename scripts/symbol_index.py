@@ -0,0 +1,267 @@
+# This module keeps an index of the node symbols of all graphml input files
+# Every question about the symbols of the inputs (the counts of a pattern of one user, the symbols
+# found in most files, which symbols occur together) used to need a full pass over the graphml files.
+# The index is built once, with the parse cache and the worker pool of the ingest, afterwards only
+# the files added or changed since are read again. It holds
+#   - a sparse files x symbols matrix in CSR form: the symbols of file i are symbols[indices[indptr[i]:indptr[i+1]]],
+#     data holds how often each of them occurs in the file
+#   - for every file its folder (the user), the patterns of [data] all_file_patterns it matches, and its rank:
+#     0 for _optimal, k + 1 for suboptimal_k, -1 for anything else
+#   - the size and mtime of every file, to tell whether the index is still current
+# It is saved as .npz, the queries below answer from the arrays alone, without reading any graphml file.
+#
+# Configured in the [index] section:
+#   file - the index file, loaded if it is current, otherwise built and written there; empty disables the index
+# Run this module to build the index for the config and log the top symbols of every pattern:
+#   python symbol_index.py
+
+import os
+import re
+import sys
+import json
+
+from collections import namedtuple
+
+import numpy as np
+
+from graphml_codec import is_graphml_file
+from graphml_ingest import ingest_graphml_files
+
+from settings import get_config
+from settings import init_logging
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+
+SUBOPTIMAL_PATTERN = re.compile(r'suboptimal_(\d+)')
+
+# meta - dictionary with the version and the graphml_dir
+# files - the file names, folders - the sorted folder names, file_folder - the folder of each file
+# patterns - the patterns of file_patterns, file_patterns - files x patterns, True where the file matches
+# file_rank - the rank of each file, file_size, file_mtime - to check whether the file has changed
+# indptr, indices, data - the symbols of the files and their number of occurrences, in CSR form
+# symbols - the sorted symbols of all files
+SymbolIndex = namedtuple('SymbolIndex', ['meta', 'files', 'folders', 'file_folder', 'patterns', 'file_patterns',
+                                         'file_rank', 'file_size', 'file_mtime', 'indptr', 'indices', 'data', 'symbols'])
+
+def get_file_rank(filename):
+    if '_optimal' in filename:
+        return 0
+    match = SUBOPTIMAL_PATTERN.search(filename)
+    if match is not None:
+        return int(match.group(1)) + 1
+    return -1
+
+def list_graphml_files(graphml_dir):
+    # the (folder, file name) of the graphml files in the folders of graphml_dir, in directory order
+    folder_files = []
+    for folder in os.listdir(graphml_dir):
+        folder_dir = os.path.join(graphml_dir, folder)
+        if not os.path.isdir(folder_dir):
+            continue
+        for file in os.listdir(folder_dir):
+            if is_graphml_file(file):
+                folder_files.append((folder, file))
+    return folder_files
+
+def get_file_stats(graphml_dir, folder_files):
+    sizes = np.zeros(len(folder_files), dtype=np.int64)
+    mtimes = np.zeros(len(folder_files), dtype=np.int64)
+    for position, (folder, file) in enumerate(folder_files):
+        stat = os.stat(os.path.join(graphml_dir, folder, file))
+        sizes[position] = stat.st_size
+        mtimes[position] = stat.st_mtime_ns
+    return sizes, mtimes
+
+def get_file_symbol_counts(index, file_position):
+    # the symbols of a file of the index and their number of occurrences
+    start, end = index.indptr[file_position], index.indptr[file_position + 1]
+    return index.symbols[index.indices[start:end]], index.data[start:end]
+
+def build_symbol_index(graphml_dir, patterns, executor=None, cache=None, previous=None):
+    # with the previous index of graphml_dir, only the files that are new or have changed since are read
+    folder_files = list_graphml_files(graphml_dir)
+    file_sizes, file_mtimes = get_file_stats(graphml_dir, folder_files)
+    previous_positions = {}
+    if previous is not None and previous.meta.get('graphml_dir') == graphml_dir:
+        previous_positions = dict((folder_file, position) for position, folder_file in
+                                  enumerate(zip(previous.folders[previous.file_folder].tolist(), previous.files.tolist())))
+    file_symbol_counts = [None] * len(folder_files)
+    changed = []
+    for position, folder_file in enumerate(folder_files):
+        previous_position = previous_positions.get(folder_file)
+        if (previous_position is not None and previous.file_size[previous_position] == file_sizes[position]
+                and previous.file_mtime[previous_position] == file_mtimes[position]):
+            file_symbol_counts[position] = get_file_symbol_counts(previous, previous_position)
+        else:
+            changed.append(position)
+    ingest_results = ingest_graphml_files(executor, [os.path.join(graphml_dir, *folder_files[position]) for position in changed], cache=cache)
+    for position, ingest_result in zip(changed, ingest_results):
+        file_symbols, file_counts = np.unique(np.array(ingest_result.symbols, dtype=str), return_counts=True)
+        file_symbol_counts[position] = (file_symbols, file_counts)
+    if previous is not None:
+        logger.info("Read {} new or changed of {} graphml files for the symbol index".format(len(changed), len(folder_files)))
+    if file_symbol_counts:
+        symbols = np.unique(np.concatenate([file_symbols for file_symbols, file_counts in file_symbol_counts]))
+    else:
+        symbols = np.zeros(0, dtype=str)
+    indptr = np.zeros(len(folder_files) + 1, dtype=np.int64)
+    np.cumsum([file_symbols.size for file_symbols, file_counts in file_symbol_counts], out=indptr[1:])
+    folders = np.array(sorted(set(folder for folder, file in folder_files)), dtype=str)
+    file_names = [file for folder, file in folder_files]
+    meta = {'version': INDEX_VERSION, 'graphml_dir': graphml_dir}
+    return SymbolIndex(meta, np.array(file_names, dtype=str),
+                       folders,
+                       np.searchsorted(folders, [folder for folder, file in folder_files]).astype(np.int32),
+                       np.array(patterns, dtype=str),
+                       np.array([[pattern in file for pattern in patterns] for file in file_names], dtype=bool).reshape(len(file_names), len(patterns)),
+                       np.array([get_file_rank(file) for file in file_names], dtype=np.int32),
+                       file_sizes, file_mtimes, indptr,
+                       np.concatenate([np.searchsorted(symbols, file_symbols) for file_symbols, file_counts in file_symbol_counts]).astype(np.int32) if file_symbol_counts else np.zeros(0, dtype=np.int32),
+                       np.concatenate([file_counts for file_symbols, file_counts in file_symbol_counts]).astype(np.int32) if file_symbol_counts else np.zeros(0, dtype=np.int32),
+                       symbols)
+
+def save_symbol_index(index, index_file):
+    part_file = "{}.part".format(index_file)
+    with open(part_file, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(index.meta)), files=index.files, folders=index.folders, file_folder=index.file_folder,
+                 patterns=index.patterns, file_patterns=index.file_patterns, file_rank=index.file_rank,
+                 file_size=index.file_size, file_mtime=index.file_mtime,
+                 indptr=index.indptr, indices=index.indices, data=index.data, symbols=index.symbols)
+    os.replace(part_file, index_file)
+
+def load_symbol_index(index_file):
+    # None for an index written by another version, it is built again
+    with np.load(index_file) as data:
+        meta = json.loads(str(data['meta']))
+        if meta.get('version') != INDEX_VERSION:
+            logger.info("Index {} has version {}, expected {}".format(index_file, meta.get('version'), INDEX_VERSION))
+            return None
+        return SymbolIndex(meta, data['files'], data['folders'], data['file_folder'], data['patterns'], data['file_patterns'],
+                           data['file_rank'], data['file_size'], data['file_mtime'], data['indptr'], data['indices'],
+                           data['data'], data['symbols'])
+
+def is_index_current(index, graphml_dir, patterns):
+    # True if the index has the same patterns and the files in graphml_dir have not changed since it was built
+    if index.meta.get('graphml_dir') != graphml_dir or index.patterns.tolist() != list(patterns):
+        return False
+    folder_files = list_graphml_files(graphml_dir)
+    if len(folder_files) != index.files.size:
+        return False
+    if folder_files != list(zip(index.folders[index.file_folder].tolist(), index.files.tolist())):
+        return False
+    file_sizes, file_mtimes = get_file_stats(graphml_dir, folder_files)
+    return bool(np.array_equal(file_sizes, index.file_size) and np.array_equal(file_mtimes, index.file_mtime))
+
+def get_symbol_index(config, executor=None, cache=None):
+    # the index of the [data] graphml_dir, loaded from [index] file if it is current, None without an index file
+    index_file = config.get('index', 'file', fallback='').strip()
+    if not index_file:
+        return None
+    graphml_dir = config['data'].get('graphml_dir')
+    patterns = config['data'].get('all_file_patterns').split(',')
+    previous = None
+    if os.path.exists(index_file):
+        previous = load_symbol_index(index_file)
+        if previous is not None and is_index_current(previous, graphml_dir, patterns):
+            logger.info("Loaded the symbol index {} of {} files".format(index_file, previous.files.size))
+            return previous
+        if previous is not None:
+            logger.info("The graphml files have changed since the symbol index {} was built".format(index_file))
+    index = build_symbol_index(graphml_dir, patterns, executor, cache, previous)
+    save_symbol_index(index, index_file)
+    logger.info("Built the symbol index {} of {} files and {} symbols".format(index_file, index.files.size, index.symbols.size))
+    return index
+
+def select_files(index, folder=None, pattern=None, rank=None):
+    # a mask of the files of the folder, matching the pattern and with the rank; None selects all
+    mask = np.ones(index.files.size, dtype=bool)
+    if folder is not None:
+        folder_position = np.searchsorted(index.folders, folder)
+        if folder_position >= index.folders.size or index.folders[folder_position] != folder:
+            return np.zeros(index.files.size, dtype=bool)
+        mask &= index.file_folder == folder_position
+    if pattern is not None:
+        pattern_positions = np.flatnonzero(index.patterns == pattern)
+        if pattern_positions.size:
+            mask &= index.file_patterns[:, pattern_positions[0]]
+        else:
+            # not one of the indexed patterns, it is matched against the file names
+            mask &= np.array([pattern in file for file in index.files.tolist()], dtype=bool)
+    if rank is not None:
+        mask &= index.file_rank == rank
+    return mask
+
+def get_entry_files(index):
+    # the file of every entry of indices and data
+    return np.repeat(np.arange(index.files.size), np.diff(index.indptr))
+
+def get_symbol_totals(index, mask, occurrences=True):
+    # per symbol the number of occurrences in the selected files, or with occurrences=False the number of files
+    selected = mask[get_entry_files(index)]
+    weights = index.data[selected] if occurrences else None
+    return np.bincount(index.indices[selected], weights=weights, minlength=index.symbols.size).astype(np.int64)
+
+def get_symbol_counts(index, mask):
+    # the symbols of the selected files with their number of occurrences, like a pass over the files would count them
+    totals = get_symbol_totals(index, mask)
+    present = np.flatnonzero(totals)
+    return dict(zip(index.symbols[present].tolist(), totals[present].tolist()))
+
+def get_file_symbols(index, file_position):
+    return index.symbols[index.indices[index.indptr[file_position]:index.indptr[file_position + 1]]].tolist()
+
+def get_folder_symbol_counts(index, folder, patterns):
+    # for every pattern the symbol counts of the files of the folder matching it, and the symbols of the
+    # last of these files, as script_file_pattern_symbol_counts gets them from a pass over the files
+    pattern_symbol_counts = {}
+    pattern_last_symbols = {}
+    for pattern in patterns:
+        mask = select_files(index, folder=folder, pattern=pattern)
+        pattern_symbol_counts[pattern] = get_symbol_counts(index, mask)
+        matching_files = np.flatnonzero(mask)
+        if matching_files.size:
+            pattern_last_symbols[pattern] = get_file_symbols(index, matching_files[-1])
+    return pattern_symbol_counts, pattern_last_symbols
+
+def get_top_symbols(index, mask, k=10, occurrences=True):
+    # the k symbols with the most occurrences (or files) in the selected files, as (symbol, count)
+    totals = get_symbol_totals(index, mask, occurrences)
+    k = min(k, int(np.count_nonzero(totals)))
+    if k <= 0:
+        return []
+    top = np.argpartition(-totals, k - 1)[:k]
+    top = top[np.lexsort((index.symbols[top], -totals[top]))]
+    return list(zip(index.symbols[top].tolist(), totals[top].tolist()))
+
+def get_cooccurrence(index, mask, symbols):
+    # the number of selected files that contain both symbols, for every pair of the given symbols
+    symbols = np.asarray(symbols)
+    symbol_positions = np.searchsorted(index.symbols, symbols)
+    known = symbol_positions < index.symbols.size
+    known[known] = index.symbols[symbol_positions[known]] == symbols[known]
+    columns = np.full(index.symbols.size, -1, dtype=np.int64)
+    columns[symbol_positions[known]] = np.flatnonzero(known)
+    entry_files = get_entry_files(index)
+    entry_columns = columns[index.indices]
+    selected = mask[entry_files] & (entry_columns >= 0)
+    presence = np.zeros((index.files.size, len(symbols)), dtype=np.int64)
+    presence[entry_files[selected], entry_columns[selected]] = 1
+    return presence.T @ presence
+
+def main(sysArgs):
+    init_logging()
+    config = get_config()
+    if not config.get('index', 'file', fallback='').strip():
+        raise Exception("No index file configured, set file in the [index] section")
+    index = get_symbol_index(config)
+    for pattern in index.patterns.tolist():
+        mask = select_files(index, pattern=pattern)
+        logger.info("{}: {} files, top symbols {}".format(pattern, int(mask.sum()), get_top_symbols(index, mask)))
+
+if __name__ == "__main__":
+
+    main(sys.argv)
@@ -0,0 +1,254 @@
+# This module generates the workload of the benchmark up front: every context to create, with its size and symbols
+# For every minSize/maxSize combination the sizes 1..size are stratified over the iterations,
+# every size is used equally often (up to one, if iter is not a multiple of size), in a random order.
+# The symbols are drawn for all contexts of a combination at once, with replacement (like the
+# original benchmark loop) or without replacement (no symbol twice in one context).
+# The random numbers come from numpy SeedSequences derived from the [random] seed: every combination
+# has its own stream, so adding a combination does not change the others, and every item gets its own
+# seed for anything random done while running it.
+#
+# The plan is kept as flat arrays, the symbols of all items in CSR form (indptr into indices,
+# which index the sorted list of node symbols), and saved as .npz. A plan can be split into shards,
+# items are dealt round robin, so that each worker loads only its own file:
+#   plan.npz with shards=1, plan-00000-of-00004.npz ... plan-00003-of-00004.npz with shards=4
+#
+# Configured in the [plan] section:
+#   file - the plan file, loaded if it exists and was generated for the current [loop] and [random] settings,
+#          otherwise generated and written there; empty keeps the plan in memory
+#   replace - draw the symbols of a context with replacement
+#   shards, shard - the number of shards and the shard to run
+# Run this module to only generate the plan file (and its shards) for the config:
+#   python workload_plan.py
+
+import os
+import sys
+import json
+
+from collections import namedtuple
+
+import numpy as np
+
+from context_load import ContextTask
+from client_pool import get_client_pool
+from network_session import get_network_session
+
+from settings import get_config
+from settings import init_logging
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+# meta - dictionary with seed, replace, iterations, max_size, shard and shards
+# combinations - array (combinations x 2) of minSize, maxSize
+# item_combination, item_iteration, item_size, item_seed - one entry per item
+# indptr, indices - the symbols of item i are symbols[indices[indptr[i]:indptr[i+1]]]
+# symbols - the sorted node symbols of the base network
+WorkloadPlan = namedtuple('WorkloadPlan', ['meta', 'combinations', 'item_combination', 'item_iteration', 'item_size',
+                                           'item_seed', 'indptr', 'indices', 'symbols'])
+
+def parse_combinations(combinations_string):
+    # "0-1,1-2" to [(0, 1), (1, 2)]
+    combinations = []
+    for combination in combinations_string.split(','):
+        sizes = combination.split('-')
+        combinations.append((int(sizes[0]), int(sizes[1])))
+    return combinations
+
+def get_root_seed(config):
+    return int(config['random'].get('seed'))
+
+def stratified_sizes(rng, iterations, max_size):
+    # the sizes 1..max_size, each used iterations/max_size times, in random order
+    return rng.permutation(np.resize(np.arange(1, max_size + 1, dtype=np.int32), iterations))
+
+def get_item_positions(indptr, items):
+    # the positions of the symbols of the given items in the flat indices
+    sizes = indptr[items + 1] - indptr[items]
+    offsets = np.zeros(items.size, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+    return np.repeat(indptr[items] - offsets, sizes) + np.arange(int(sizes.sum()))
+
+def draw_symbol_indices(rng, sizes, symbol_count, replace=True):
+    # draws the symbols of all items at once, returns the flat indices in item order
+    if replace:
+        return rng.integers(0, symbol_count, size=int(sizes.sum()), dtype=np.int32)
+    if sizes.size and sizes.max() > symbol_count:
+        raise Exception("Cannot draw {} different symbols out of {}".format(sizes.max(), symbol_count))
+    indptr = np.zeros(sizes.size + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    rows = np.repeat(np.arange(sizes.size, dtype=np.int64), sizes)
+    indices = rng.integers(0, symbol_count, size=rows.size, dtype=np.int32)
+    positions = np.arange(rows.size)
+    # redraw the symbols drawn twice for the same item, checking only the items with redrawn symbols again
+    while positions.size:
+        keys = rows[positions] * symbol_count + indices[positions]
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        duplicates = np.zeros(order.size, dtype=bool)
+        duplicates[1:] = sorted_keys[1:] == sorted_keys[:-1]
+        redraw = positions[order[duplicates]]
+        indices[redraw] = rng.integers(0, symbol_count, size=redraw.size, dtype=np.int32)
+        positions = get_item_positions(indptr, np.unique(rows[redraw]))
+    return indices
+
+def build_workload_plan(symbols, combinations, iterations, max_size, seed, replace=True):
+    symbols = np.array(sorted(set(symbols)))
+    root = np.random.SeedSequence(seed)
+    item_combination = []
+    item_iteration = []
+    item_size = []
+    item_seed = []
+    item_indices = []
+    combination_seeds = root.spawn(len(combinations))
+    for combination_index in range(len(combinations)):
+        draw_seed, items_seed = combination_seeds[combination_index].spawn(2)
+        rng = np.random.default_rng(draw_seed)
+        sizes = stratified_sizes(rng, iterations, max_size)
+        item_combination.append(np.full(iterations, combination_index, dtype=np.int32))
+        item_iteration.append(np.arange(1, iterations + 1, dtype=np.int32))
+        item_size.append(sizes)
+        item_seed.append(items_seed.generate_state(iterations, np.uint64))
+        item_indices.append(draw_symbol_indices(rng, sizes, symbols.size, replace))
+    item_size = np.concatenate(item_size) if item_size else np.zeros(0, dtype=np.int32)
+    indptr = np.zeros(item_size.size + 1, dtype=np.int64)
+    np.cumsum(item_size, out=indptr[1:])
+    meta = {'version': PLAN_VERSION, 'seed': seed, 'replace': replace, 'iterations': iterations,
+            'max_size': max_size, 'shard': 0, 'shards': 1}
+    return WorkloadPlan(meta, np.array(combinations, dtype=np.int32).reshape(-1, 2),
+                        np.concatenate(item_combination) if item_combination else np.zeros(0, dtype=np.int32),
+                        np.concatenate(item_iteration) if item_iteration else np.zeros(0, dtype=np.int32),
+                        item_size,
+                        np.concatenate(item_seed) if item_seed else np.zeros(0, dtype=np.uint64),
+                        indptr,
+                        np.concatenate(item_indices) if item_indices else np.zeros(0, dtype=np.int32),
+                        symbols)
+
+def select_items(plan, items, shard, shards):
+    # the plan with only the given items (an array of item numbers)
+    sizes = plan.item_size[items]
+    indptr = np.zeros(items.size + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    positions = get_item_positions(plan.indptr, items)
+    meta = dict(plan.meta)
+    meta['shard'] = shard
+    meta['shards'] = shards
+    return WorkloadPlan(meta, plan.combinations, plan.item_combination[items], plan.item_iteration[items], sizes,
+                        plan.item_seed[items], indptr, plan.indices[positions], plan.symbols)
+
+def get_shard(plan, shard, shards):
+    return select_items(plan, np.arange(shard, plan.item_size.size, shards), shard, shards)
+
+def get_shard_file(plan_file, shard, shards):
+    if shards == 1:
+        return plan_file
+    base, extension = os.path.splitext(plan_file)
+    return "{}-{:05d}-of-{:05d}{}".format(base, shard, shards, extension or '.npz')
+
+def save_workload_plan(plan, plan_file, shards=1):
+    # writes the plan as shards files, returns their names
+    shard_files = []
+    for shard in range(shards):
+        shard_plan = get_shard(plan, shard, shards) if shards > 1 else plan
+        shard_file = get_shard_file(plan_file, shard, shards)
+        part_file = "{}.part".format(shard_file)
+        with open(part_file, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(shard_plan.meta)), combinations=shard_plan.combinations,
+                     item_combination=shard_plan.item_combination, item_iteration=shard_plan.item_iteration,
+                     item_size=shard_plan.item_size, item_seed=shard_plan.item_seed,
+                     indptr=shard_plan.indptr, indices=shard_plan.indices, symbols=shard_plan.symbols)
+        os.replace(part_file, shard_file)
+        shard_files.append(shard_file)
+    return shard_files
+
+def load_workload_plan(plan_file, shard=0, shards=1):
+    with np.load(get_shard_file(plan_file, shard, shards)) as data:
+        meta = json.loads(str(data['meta']))
+        if meta.get('version') != PLAN_VERSION:
+            raise Exception("Plan {} has version {}, expected {}".format(plan_file, meta.get('version'), PLAN_VERSION))
+        return WorkloadPlan(meta, data['combinations'], data['item_combination'], data['item_iteration'], data['item_size'],
+                            data['item_seed'], data['indptr'], data['indices'], data['symbols'])
+
+def build_configured_plan(config, symbols):
+    # the plan for the [loop] settings of the config
+    return build_workload_plan(symbols, parse_combinations(config['loop'].get('combinations')),
+                               config.getint('loop', 'iter'), config.getint('loop', 'size'), get_root_seed(config),
+                               replace=config.getboolean('plan', 'replace', fallback=True))
+
+def get_plan_mismatches(config, plan):
+    # the settings the loaded plan was generated with that differ from the config, empty if it matches
+    expected = {'seed': get_root_seed(config), 'replace': config.getboolean('plan', 'replace', fallback=True),
+                'iterations': config.getint('loop', 'iter'), 'max_size': config.getint('loop', 'size'),
+                'shards': config.getint('plan', 'shards', fallback=1)}
+    mismatches = ["{} {} instead of {}".format(name, plan.meta.get(name), value) for name, value in sorted(expected.items()) if plan.meta.get(name) != value]
+    combinations = [tuple(int(size) for size in combination) for combination in plan.combinations]
+    if combinations != parse_combinations(config['loop'].get('combinations')):
+        mismatches.append("combinations {} instead of {}".format(combinations, config['loop'].get('combinations')))
+    return mismatches
+
+def get_workload_plan(config, get_symbols):
+    # the plan (or the configured shard of it) for the config, loaded from [plan] file if it exists
+    # get_symbols is only called if the plan has to be generated and returns the node symbols of the base network
+    plan_file = config.get('plan', 'file', fallback='').strip()
+    shards = config.getint('plan', 'shards', fallback=1)
+    shard = config.getint('plan', 'shard', fallback=0)
+    if plan_file and os.path.exists(get_shard_file(plan_file, shard, shards)):
+        logger.info("Loading shard {} of {} of the workload plan {}".format(shard, shards, plan_file))
+        plan = load_workload_plan(plan_file, shard, shards)
+        mismatches = get_plan_mismatches(config, plan)
+        if not mismatches:
+            return plan
+        logger.warning("Workload plan {} does not match the config ({}), generating it again".format(plan_file, ", ".join(mismatches)))
+    plan = build_configured_plan(config, get_symbols())
+    logger.info("Generated a workload plan with {} contexts".format(plan.item_size.size))
+    if plan_file:
+        save_workload_plan(plan, plan_file, shards)
+    if shards > 1:
+        return get_shard(plan, shard, shards)
+    return plan
+
+def get_item_seeds(plan, combination_index=None):
+    # the seeds of the items, in the order of get_context_tasks
+    if combination_index is None:
+        return plan.item_seed
+    return plan.item_seed[plan.item_combination == combination_index]
+
+def get_context_tasks(plan, combination_index=None):
+    # the ContextTasks of the plan, of all combinations or only of the given one
+    if combination_index is None:
+        items = np.arange(plan.item_size.size)
+    else:
+        items = np.flatnonzero(plan.item_combination == combination_index)
+    # the symbols of all selected items in one lookup, split into the items below
+    # (from an object array, converting numpy strings to python strings one by one is slow)
+    symbols = np.array(plan.symbols.tolist(), dtype=object)
+    item_symbols = symbols[plan.indices[get_item_positions(plan.indptr, items)]].tolist()
+    ends = np.cumsum(plan.item_size[items]).tolist()
+    combinations = plan.combinations.tolist()
+    tasks = []
+    start = 0
+    for item_combination, iteration, size, seed, end in zip(plan.item_combination[items].tolist(), plan.item_iteration[items].tolist(),
+                                                              plan.item_size[items].tolist(), plan.item_seed[items].tolist(), ends):
+        min_size, max_size = combinations[item_combination]
+        tasks.append(ContextTask(iteration, size, min_size, max_size, item_symbols[start:end], seed))
+        start = end
+    return tasks
+
+def main(sysArgs):
+    init_logging()
+    config = get_config()
+    plan_file = config.get('plan', 'file', fallback='').strip()
+    if not plan_file:
+        raise Exception("No plan file configured, set file in the [plan] section")
+    client = get_client_pool(config).get_client("contextcreationtimer")
+    session = get_network_session(config)
+    base_name = config['network'].get('base_name')
+    plan = build_configured_plan(config, session.get_node_symbols(client, base_name))
+    for shard_file in save_workload_plan(plan, plan_file, config.getint('plan', 'shards', fallback=1)):
+        logger.info("Wrote {}".format(shard_file))
+
+if __name__ == "__main__":
+
+    main(sys.argv)
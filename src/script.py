@@ -1,19 +1,201 @@
 import os
 import sys
-
-from pysbml4j import Sbml4j
-from pysbml4j import Configuration
+import json
+import time
+import queue
+import threading
+import importlib
+import socketserver
 
 import logging
-from logging.config import fileConfig
-import configparser
 
 configFolder = "/config"
-fileConfig('{}/config.ini'.format(configFolder))
 logger = logging.getLogger()
-logging.getLogger("chardet.charsetprober").disabled = True
+
+# Runner mode
+# python /code/script.py --runner [--scripts-dir DIR] (--queue FILE [--follow] | --socket PATH)
+# runs many jobs in this one process, instead of one container start per script.
+# A job is one line of JSON:
+#   {"id": "job-1", "script": "getNetwork.py", "args": ["<uuid>"], "config": {"data": {"output_codec": "gzip"}}}
+# The script is imported from the scripts dir once (again only if the file has changed) and its
+# main is called with [script] + args, after the config overrides have been applied to the config of the
+# script; they are reverted when the job is done. Modules stay loaded and the connections of the
+# client pool stay open between jobs. A job overriding the pool_* options of [server] gets a pool of its own.
+# Logging is configured once, by the settings module of the scripts dir, so the init_logging of the jobs does nothing.
+#   --queue FILE - run the jobs in FILE, the result of every job is appended to FILE.results;
+#                  with --follow, keep waiting for new lines appended to FILE
+#   --socket PATH - listen on a unix socket, every line sent is a job, the result is sent back as a line of JSON
+# Jobs are run one at a time, in the order they arrive
+
+class JobRunner(object):
+
+    def __init__(self, scripts_dir):
+        self.scripts_dir = scripts_dir
+        if scripts_dir not in sys.path:
+            sys.path.insert(0, scripts_dir)
+        self._modules = {}
+
+    def get_module(self, script):
+        # imports the script once, and again when its file has changed
+        module_name = os.path.splitext(os.path.basename(script))[0]
+        script_file = os.path.join(self.scripts_dir, "{}.py".format(module_name))
+        mtime = os.stat(script_file).st_mtime_ns
+        cached = self._modules.get(module_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if cached is not None:
+            module = importlib.reload(cached[1])
+        else:
+            module = importlib.import_module(module_name)
+        self._modules[module_name] = (mtime, module)
+        return module
+
+    def run_job(self, job):
+        result = {'id': job.get('id'), 'script': job.get('script')}
+        start_time = time.perf_counter()
+        saved_config = None
+        module = None
+        saved_argv = sys.argv
+        try:
+            module = self.get_module(job['script'])
+            saved_config = apply_config_overrides(getattr(module, 'config', None), job.get('config', {}))
+            # the networks on the server may have changed since the last job
+            if 'client_pool' in sys.modules:
+                sys.modules['client_pool'].invalidate_network_lists()
+            sys.argv = [job['script']] + [str(arg) for arg in job.get('args', [])]
+            module.main(sys.argv)
+            result['success'] = True
+        except (Exception, SystemExit) as e:
+            logger.exception("Job {} failed".format(job.get('id', job.get('script'))))
+            result['success'] = False
+            result['error'] = str(e)
+        finally:
+            sys.argv = saved_argv
+            if saved_config is not None:
+                restore_config(module.config, saved_config)
+        result['elapsed'] = time.perf_counter() - start_time
+        logger.info("Job {} ({}) finished in {:0.4f} seconds, success: {}".format(result['id'], result['script'], result['elapsed'], result['success']))
+        return result
+
+def apply_config_overrides(config, overrides):
+    # returns what is needed to restore the config
+    if config is None or not overrides:
+        return None
+    saved_config = {}
+    for section, options in overrides.items():
+        if config.has_section(section):
+            saved_config[section] = dict(config.items(section, raw=True))
+        else:
+            saved_config[section] = None
+            config.add_section(section)
+        for option, value in options.items():
+            config.set(section, option, str(value))
+    return saved_config
+
+def restore_config(config, saved_config):
+    for section, options in saved_config.items():
+        config.remove_section(section)
+        if options is not None:
+            config.add_section(section)
+            for option, value in options.items():
+                config.set(section, option, value)
+
+def parse_job(line):
+    job = json.loads(line)
+    if 'script' not in job:
+        raise Exception("Job without script: {}".format(line))
+    return job
+
+def run_queued_job(runner, line):
+    try:
+        return runner.run_job(parse_job(line))
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def run_queue_file(runner, queue_file, follow=False, poll_interval=1.0):
+    with open(queue_file) as jobs, open("{}.results".format(queue_file), 'a') as results:
+        while True:
+            position = jobs.tell()
+            line = jobs.readline()
+            if not line.endswith('\n'):
+                # the end of the file, the last line may still be written to
+                if follow:
+                    jobs.seek(position)
+                    time.sleep(poll_interval)
+                    continue
+                if line.strip():
+                    results.write(json.dumps(run_queued_job(runner, line)) + "\n")
+                return
+            if line.strip():
+                results.write(json.dumps(run_queued_job(runner, line)) + "\n")
+                results.flush()
+
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    # hands every job to the main thread and sends back its result
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8').strip()
+            if not line:
+                continue
+            try:
+                job = parse_job(line)
+            except Exception as e:
+                self.wfile.write((json.dumps({'success': False, 'error': str(e)}) + "\n").encode('utf-8'))
+                continue
+            reply = queue.Queue(maxsize=1)
+            self.server.jobs.put((job, reply))
+            self.wfile.write((json.dumps(reply.get()) + "\n").encode('utf-8'))
+
+def run_socket(runner, socket_path):
+    # the jobs are run on the main thread, so the clients of the pool are reused between them
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, JobRequestHandler)
+    server.daemon_threads = True
+    server.jobs = queue.Queue()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Runner listening on {}".format(socket_path))
+    try:
+        while True:
+            job, reply = server.jobs.get()
+            reply.put(runner.run_job(job))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.remove(socket_path)
+
+def get_option(sysArgs, name, default=None):
+    if name in sysArgs and sysArgs.index(name) + 1 < len(sysArgs):
+        return sysArgs[sysArgs.index(name) + 1]
+    return default
+
+def run_runner(sysArgs):
+    runner = JobRunner(get_option(sysArgs, '--scripts-dir', os.path.dirname(os.path.abspath(__file__))))
+    # the logging of the jobs, configured here once, from the scripts dir that is now on the path
+    importlib.import_module('settings').init_logging()
+    queue_file = get_option(sysArgs, '--queue')
+    socket_path = get_option(sysArgs, '--socket')
+    if queue_file is not None:
+        run_queue_file(runner, queue_file, follow='--follow' in sysArgs)
+    elif socket_path is not None:
+        run_socket(runner, socket_path)
+    else:
+        raise Exception("The runner needs --queue FILE or --socket PATH")
+
+def init_logging():
+    # configured when the container starts the script, not when it is imported
+    from logging.config import fileConfig
+    fileConfig('{}/config.ini'.format(configFolder), disable_existing_loggers=False)
+    logging.getLogger("chardet.charsetprober").disabled = True
 
 def main(sysArgs):
+    if '--runner' in sysArgs:
+        run_runner(sysArgs)
+        return
+    init_logging()
     logger.debug("This is the default script.")
     logger.debug("Place your file named 'script.py'")
     logger.debug("in the folder that is mounted to the")
@@ -21,6 +203,7 @@ def main(sysArgs):
     logger.debug("'Place your configuration file named 'config.ini'")
     logger.debug("in the filder that is mounted to the")
     logger.debug("'/config'-folder inside the container")
+    logger.debug("Or start it with --runner to run a queue of jobs, see the comments above")
 
 
 